@@ -1,36 +1,26 @@
 """
 
-    Creates an unbalanced Imagenet2012 classification dataset
+    Downloads an Imagenet2012 classification (ILSVRC2012) dataset
 
-"""
+    The classes come from resolver.py, by default all 1000 of them, or a subset given as
+    class indices, wnids or names with -classes. Every other argument goes to the downloader:
 
-import pandas as pd
+        python LVSRC.py -data_root ./test1 -images_per_class 500 -classes 0 1 goldfish
 
-classes=[i.split(":")[-1] for i in open("Imagenet_classes").read().replace("}","").split('\n')]
-classes=[i.replace("'",'') for i in classes]
-data=pd.read_csv("classes_in_imagenet.csv")
-"""
-s1 = pd.Series(classes)
-for i in data['class_name']:
-...     s1.str.contains(i)
-...     
 """
 
+import downloader
+from resolver import get_resolver
 
-unsplit=[]
-for i in classes:
-     for j in i.split(","):
-        unsplit.append(j.strip())
 
-ids=data[data.isin(unsplit)['class_name']]['synid']
-f=open("dowloader.sh",'w')
+if __name__ == '__main__':
 
-f.write("""python ./downloader.py \
-    -data_root ./test1 \
-    -use_class_list True \
-    -class_list %s \
-    -images_per_class 500 \
-    -multiprocessing_workers 24 \ 
-"""%" ".join([i for i in ids.values]))
+    parser = downloader.build_parser()
+    parser.set_defaults(data_root='./test1', images_per_class=500, multiprocessing_workers=24)
+    parser.add_argument('-classes', default=None, nargs='*')
+    args, args_other = parser.parse_known_args()
 
-f.close()
\ No newline at end of file
+    # Without a class list the downloader takes all ILSVRC2012 classes that have urls
+    args.use_class_list = True
+    args.class_list = [get_resolver().resolve(item) for item in args.classes] if args.classes else None
+    downloader.main(args)
@@ -0,0 +1,365 @@
+"""
+
+    asyncio download engine. Image fetches of every picked class are kept in flight
+    at the same time, bounded by a global and a per-host connection limit, so a run
+    no longer waits for the slowest url of each class before moving on.
+
+"""
+
+import os
+import hashlib
+import time
+import asyncio
+import functools
+import logging
+import sqlite3
+
+import aiohttp
+
+from host_health import make_host_health
+from ratelimit import make_host_rate_limiter, make_async_concurrency_limit
+from validate import make_validator
+from common import IMAGENET_API_WNID_TO_URLS, ClassState, url_class, image_name_from_url, \
+    check_status, check_image_headers, check_content_length, check_image_size, drainable, wanted_url, \
+    class_folder_names, partial_image_path, remove_partial_images, CHUNK_SIZE
+
+
+class AsyncScraper():
+    def __init__(self, args, run_stats, journal, store, metrics, url_index, class_plan):
+        self.args = args
+        self.run_stats = run_stats
+        self.metrics = metrics
+        self.journal = journal
+        self.store = store
+        self.url_index = url_index
+        self.class_plan = class_plan
+        self.host_health = make_host_health(args)
+        self.host_limiter = make_host_rate_limiter(args)
+        self.validator = make_validator(args)
+        self.concurrency = None
+        self.url_tries = 0
+        self.session = None
+        self.in_flight = None
+        self.pending_by_class = dict()
+        self.class_states = dict()
+
+    def count_try(self):
+        self.url_tries += 1
+        if self.url_tries % 250 == 0:
+            self.run_stats.print_report(print)
+            self.host_health.print_stats(print)
+            self.concurrency.print_stats(print)
+
+    def connection_trace_config(self):
+        """ Feeds the connection reuse counters of RunStats from the aiohttp connector """
+        run_stats = self.run_stats
+
+        async def on_connection_create_end(session, context, params):
+            run_stats.inc('connections', 'checkouts', 1)
+            run_stats.inc('connections', 'new', 1)
+
+        async def on_connection_reuseconn(session, context, params):
+            run_stats.inc('connections', 'checkouts', 1)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def fetch_url_list(self, api_session, wnid):
+        """ Url list from the journal, the local index or the API, None if there is none """
+        urls = self.journal.url_list(wnid)
+        if urls is not None:
+            return urls
+
+        urls = self.url_index.url_list(wnid)
+        if urls is not None:
+            return urls
+
+        if self.args.offline:
+            logging.error(f'Class {wnid} is not in the url index, skipping it in offline mode')
+            return None
+
+        if self.args.url_list_rate > 0:
+            await asyncio.sleep(1.0 / self.args.url_list_rate)
+        try:
+            async with api_session.get(IMAGENET_API_WNID_TO_URLS(wnid, self.args.api_url)) as resp:
+                status = resp.status
+                content = await resp.read()
+        except aiohttp.ClientError as e:
+            logging.error(f'Could not fetch url list for class {wnid}: {e}')
+            return None
+
+        # An error page is not a url list, saving it would mark the class as exhausted for good
+        if not 200 <= status < 300:
+            logging.error(f'Could not fetch url list for class {wnid}: http status {status}')
+            return None
+        urls = [url.decode('utf-8', errors='ignore') for url in content.splitlines()]
+
+        self.journal.save_url_list(wnid, urls)
+        return urls
+
+    async def stream_to_file(self, img_resp, file_path):
+        """ Async twin of common.stream_to_file, also cleans up when the fetch gets cancelled """
+        max_image_size = self.args.max_image_bytes
+        size = 0
+        sha1 = hashlib.sha1()
+        reason = None
+        try:
+            with open(file_path, 'wb') as img_f:
+                async for chunk in img_resp.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_image_size > 0 and size > max_image_size:
+                        reason = 'too large'
+                        break
+                    sha1.update(chunk)
+                    img_f.write(chunk)
+        except BaseException:
+            os.remove(file_path)
+            raise
+
+        reason = reason or check_image_size(size)
+        if reason is not None:
+            os.remove(file_path)
+
+        return size, sha1.hexdigest(), reason
+
+    async def get_image(self, img_url, class_state):
+
+        if not self.host_health.allow(img_url):
+            logging.debug("Skipping url on dead host %s", img_url)
+            return
+
+        try:
+            await self.fetch_image(img_url, class_state)
+        finally:
+            # Also when the fetch was cancelled
+            self.host_health.release(img_url)
+
+    async def fetch_image(self, img_url, class_state):
+
+        cls = url_class(img_url)
+        t_start = time.time()
+
+        def finish(status, reason=None, size=0):
+            self.run_stats.finish(cls, time.time() - t_start, status, reason, size)
+            class_state.count_tried(size)
+            self.journal.record(class_state.wnid, img_url, status, reason)
+
+        self.count_try()
+
+        img_name = image_name_from_url(img_url)
+
+        if (len(img_name) <= 1):
+            return finish('failure', 'no file name')
+
+        delay = self.host_limiter.delay(img_url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await self.concurrency.acquire()
+        t_start = time.time()
+
+        timeout = self.host_health.timeout(img_url)
+        size = 0
+        try:
+            async with self.session.get(img_url, timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout,
+                                                                             sock_read=timeout)) as img_resp:
+                latency = time.time() - t_start
+                self.host_health.record_success(img_url, latency)
+
+                reason = check_status(img_resp.status)
+                self.concurrency.record(reason, latency)
+
+                # Headers decide before the body is read, large rejected bodies are never transferred
+                reason = reason or check_image_headers(img_resp.headers) or \
+                    check_content_length(img_resp.headers, self.args.max_image_bytes)
+
+                if reason is not None and drainable(img_resp.headers):
+                    await img_resp.read()
+
+                if reason is None:
+                    partial_path = partial_image_path(class_state.class_folder, img_name)
+                    size, digest, reason = await self.stream_to_file(img_resp, partial_path)
+        except asyncio.TimeoutError:
+            logging.debug("Read Timeout for url %s", img_url)
+            self.host_health.record_failure(img_url, timeout)
+            self.concurrency.record('read timeout', timeout)
+            return finish('failure', 'read timeout')
+        except aiohttp.ClientConnectionError:
+            logging.debug("Connection Error for url %s", img_url)
+            self.host_health.record_failure(img_url)
+            return finish('failure', 'connection error')
+        except aiohttp.TooManyRedirects:
+            logging.debug("Too many redirects %s", img_url)
+            return finish('failure', 'too many redirects')
+        except (aiohttp.InvalidURL, ValueError):
+            return finish('failure', 'invalid url')
+        except aiohttp.ClientError:
+            return finish('failure', 'request error')
+        finally:
+            self.concurrency.release()
+
+        if reason is None:
+            reason, img_name, size, digest = await self.validate(partial_path, img_name, size, digest)
+
+        if reason is not None:
+            logging.debug("Rejected %s: %s", img_url, reason)
+            return finish('failure', reason, size)
+
+        # Other fetches of this class may have filled the quota while this one was in flight
+        if not class_state.add_image():
+            os.remove(partial_path)
+            return
+
+        logging.debug('Saving image %s of class %s', img_name, class_state.wnid)
+
+        rejected, removed = self.save(class_state, img_url, img_name, partial_path, digest, size)
+        self.images_removed(removed)
+        if rejected is not None:
+            class_state.remove_image()
+            logging.debug("Rejected %s: %s", img_url, rejected)
+            return finish('failure', rejected, size)
+
+        finish('success', size=size)
+        if class_state.done():
+            self.cancel_class(class_state)
+
+    def save(self, class_state, img_url, img_name, partial_path, digest, size):
+        """ store.save, a failing write rejects the image instead of being lost in gather() """
+        try:
+            return self.store.save(class_state.wnid, img_url, img_name, class_state.class_folder,
+                                   partial_path, digest, size)
+        except (OSError, sqlite3.Error):
+            logging.exception(f'Could not save {img_name}')
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return 'write error', []
+
+    async def validate(self, partial_path, img_name, size, digest):
+        """ Waits for the validation processes without blocking the event loop """
+        future = self.validator.submit(partial_path, img_name, size, digest)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # The worker still finishes the file, remove it once it is done with it
+            def remove_partial(_):
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            future.add_done_callback(remove_partial)
+            raise
+
+    def images_removed(self, removed):
+        """ Gives back the quota of stored images that turned out to be placeholders """
+        for wnid, url in removed:
+            self.journal.remove_image(wnid, url, 'placeholder')
+            class_state = self.class_states.get(wnid)
+            if class_state is not None:
+                class_state.remove_image()
+
+    def cancel_class(self, class_state):
+        """ Cancels the fetches of a class that are still in flight once its quota is filled """
+        current = asyncio.current_task()
+        for task in self.pending_by_class.get(class_state.wnid, ()):
+            if task is not current:
+                task.cancel()
+
+    def fetch_done(self, class_state, pending, task):
+        # A done callback instead of a finally block, a task cancelled before it started never runs its body
+        pending.discard(task)
+        class_state.task_done()
+        self.in_flight.release()
+
+    async def scrape_class(self, urls, class_state):
+
+        pending = set()
+        self.pending_by_class[class_state.wnid] = pending
+        self.class_states[class_state.wnid] = class_state
+        self.metrics.track(class_state)
+
+        finished_urls = self.journal.finished_urls(class_state.wnid)
+        class_state.exhausted = True
+
+        for img_url in urls:
+
+            if img_url in finished_urls or not wanted_url(img_url, self.args.scrape_only_flickr):
+                continue
+
+            # Only submit as many urls as the success rate predicts are needed for the quota
+            while pending and len(pending) >= class_state.budget(self.run_stats.success_rate()):
+                await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+
+            if class_state.done():
+                class_state.exhausted = False
+                break
+
+            await self.in_flight.acquire()
+            if class_state.done():
+                self.in_flight.release()
+                class_state.exhausted = False
+                break
+
+            self.journal.record(class_state.wnid, img_url, 'pending')
+            class_state.submit()
+            task = asyncio.ensure_future(self.get_image(img_url, class_state))
+            task.add_done_callback(functools.partial(self.fetch_done, class_state, pending))
+            pending.add(task)
+
+        if class_state.done():
+            self.cancel_class(class_state)
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        del self.pending_by_class[class_state.wnid]
+        del self.class_states[class_state.wnid]
+        self.metrics.untrack(class_state)
+        self.journal.finish_class(class_state.wnid, class_state.images, class_state.exhausted and not class_state.done())
+        logging.info("[downloaded]%s:%i"%(class_state.class_name,int(self.run_stats.get("all","success"))))
+
+    async def scrape(self, classes_to_scrape, class_info_dict, imagenet_images_folder):
+
+        self.in_flight = asyncio.Semaphore(self.args.async_max_connections)
+        self.concurrency = make_async_concurrency_limit(self.args, self.args.async_max_connections)
+        connector = aiohttp.TCPConnector(limit=self.args.async_max_connections,
+                                         limit_per_host=self.args.max_connections_per_host)
+
+        async with aiohttp.ClientSession() as api_session, \
+                aiohttp.ClientSession(connector=connector, trace_configs=[self.connection_trace_config()]) as self.session:
+
+            folder_names = class_folder_names(class_info_dict, classes_to_scrape)
+            class_tasks = []
+            for class_wnid in classes_to_scrape:
+
+                class_name = class_info_dict[class_wnid]["class_name"]
+                print(f'Scraping images for class \"{class_name}\"')
+
+                urls = await self.fetch_url_list(api_session, class_wnid)
+                if urls is None:
+                    continue
+
+                class_folder = os.path.join(imagenet_images_folder, folder_names[class_wnid])
+                if not os.path.exists(class_folder):
+                    os.mkdir(class_folder)
+                remove_partial_images(class_folder)
+
+                # A planned class stops once its url budget is spent
+                budget = self.class_plan.url_budget(class_wnid)
+                if budget is not None:
+                    urls = [url for url in urls if wanted_url(url, self.args.scrape_only_flickr)][:budget]
+
+                class_state = ClassState(class_wnid, class_name, class_folder, self.class_plan.quota(class_wnid))
+                if self.args.journal:
+                    class_state.resume(self.store.count_images(class_wnid, class_folder))
+                class_tasks.append(asyncio.ensure_future(self.scrape_class(urls, class_state)))
+
+            await asyncio.gather(*class_tasks)
+
+
+def scrape_classes_async(args, classes_to_scrape, class_info_dict, imagenet_images_folder, run_stats, journal,
+                         store, metrics, url_index, class_plan):
+    print(f"asyncio engine: {args.async_max_connections} connections,"
+          f" {args.max_connections_per_host} per host")
+    scraper = AsyncScraper(args, run_stats, journal, store, metrics, url_index, class_plan)
+    try:
+        asyncio.run(scraper.scrape(classes_to_scrape, class_info_dict, imagenet_images_folder))
+    finally:
+        scraper.validator.close()
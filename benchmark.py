@@ -0,0 +1,188 @@
+"""
+
+    Reproducible throughput benchmark of downloader.py against mock_server.py, no internet needed.
+
+    The mock server is started once, every combination of -engines and -concurrency then runs the
+    downloader as a fresh child process on a temporary -data_root, with -api_url pointed at the
+    server. -concurrency is -multiprocessing_workers for the threads engine and
+    -async_max_connections for asyncio. For every run it reports images stored, images/s, MB/s,
+    CPU seconds and use, and the peak RSS of the downloader process:
+
+        python benchmark.py -engines threads asyncio -concurrency 8 32 128 \\
+            -classes 4 -images_per_class 100 -latency_ms 50 -error_rate 0.05 -output bench.csv
+
+    Arguments of mock_server.py (-latency_ms, -error_rate, -timeout_rate, -payload_kb, ...)
+    configure the server, unknown arguments are passed on to the downloader. With
+    -baseline bench.csv a run slower in images/s than the same setting of an earlier -output by
+    more than -tolerance is reported and the benchmark exits with code 1.
+    CPU and RSS are measured with os.wait4, they are left empty where it is not available.
+
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import mock_server
+from resolver import get_resolver
+from sharding import STATS_FILENAME
+
+
+CURRENT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+
+FIELDS = ['engine', 'concurrency', 'images', 'seconds', 'images_per_s', 'mb_per_s', 'cpu_seconds', 'cpu_percent',
+          'peak_rss_mb']
+
+
+def start_mock_server(server_args):
+    """ Returns the server process and the port it listens on """
+    cmd = [sys.executable, os.path.join(CURRENT_FOLDER, 'mock_server.py')]
+    for key, value in vars(server_args).items():
+        cmd += [f'-{key}', str(value)]
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('Listening on port'):
+        process.kill()
+        raise RuntimeError(f'Mock server did not start: {line}')
+    return process, int(line.split()[-1])
+
+
+def run_downloader(argv, verbose):
+    """ Runs downloader.py as a child process, returns (wall seconds, cpu seconds, peak rss MB) """
+    cmd = [sys.executable, os.path.join(CURRENT_FOLDER, 'downloader.py')] + argv
+    output = None if verbose else subprocess.DEVNULL
+
+    t_start = time.time()
+    process = subprocess.Popen(cmd, stdout=output, stderr=output)
+
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return time.time() - t_start, None, None
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    t_spent = time.time() - t_start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    if process.returncode != 0:
+        raise RuntimeError(f'Downloader exited with code {process.returncode}: {" ".join(cmd)}')
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_mb = rusage.ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    return t_spent, rusage.ru_utime + rusage.ru_stime, rss_mb
+
+
+def run_setting(args, engine, concurrency, port, downloader_argv):
+    data_root = tempfile.mkdtemp(prefix='imagenet_benchmark_')
+    try:
+        argv = ['-data_root', data_root,
+                '-use_class_list', 'True',
+                '-class_list'] + get_resolver().ilsvrc_wnids[:args.classes] + [
+                '-images_per_class', str(args.images_per_class),
+                '-engine', engine,
+                '-api_url', f'http://127.0.0.1:{port}/api?wnid={{wnid}}',
+                '-url_list_rate', '0',
+                '-metrics_interval', '0']
+        if engine == 'asyncio':
+            argv += ['-async_max_connections', str(concurrency)]
+        else:
+            argv += ['-multiprocessing_workers', str(concurrency)]
+
+        t_spent, cpu_seconds, rss_mb = run_downloader(argv + downloader_argv, args.verbose)
+
+        with open(os.path.join(data_root, 'imagenet_images', STATS_FILENAME)) as stats_f:
+            snapshot = json.load(stats_f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    images = snapshot['all']['success']
+    return dict(
+        engine=engine,
+        concurrency=concurrency,
+        images=images,
+        seconds=round(t_spent, 2),
+        images_per_s=round(images / t_spent, 1),
+        mb_per_s=round(snapshot['all']['bytes'] / 1024 / 1024 / t_spent, 2),
+        cpu_seconds=None if cpu_seconds is None else round(cpu_seconds, 2),
+        cpu_percent=None if cpu_seconds is None else round(100 * cpu_seconds / t_spent, 1),
+        peak_rss_mb=None if rss_mb is None else round(rss_mb, 1),
+    )
+
+
+def print_results(results):
+    print(' '.join(f'{field:>12}' for field in FIELDS))
+    for result in results:
+        print(' '.join(f'{"" if result[field] is None else result[field]:>12}' for field in FIELDS))
+
+
+def write_results(results, output_path):
+    with open(output_path, 'w', newline='') as output_f:
+        csv_writer = csv.DictWriter(output_f, fieldnames=FIELDS)
+        csv_writer.writeheader()
+        csv_writer.writerows(results)
+
+
+def find_regressions(results, baseline_path, tolerance):
+    """ Settings whose images/s dropped by more than tolerance against the baseline csv """
+    with open(baseline_path, newline='') as baseline_f:
+        baseline = {(row['engine'], int(row['concurrency'])): float(row['images_per_s'])
+                    for row in csv.DictReader(baseline_f)}
+
+    regressions = []
+    for result in results:
+        before = baseline.get((result['engine'], result['concurrency']))
+        if before is not None and result['images_per_s'] < before * (1 - tolerance):
+            regressions.append((result['engine'], result['concurrency'], before, result['images_per_s']))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    server_args, args_other = mock_server.build_parser().parse_known_args()
+
+    parser = argparse.ArgumentParser(description='Benchmark the downloader against a local mock image server')
+    parser.add_argument('-engines', default=['threads', 'asyncio'], nargs='+', choices=['threads', 'asyncio'])
+    parser.add_argument('-concurrency', default=[8, 32, 128], nargs='+', type=int)
+    parser.add_argument('-classes', default = 4, type=int)
+    parser.add_argument('-images_per_class', default = 100, type=int)
+    # Every setting is run this many times, the run with the median images/s is reported
+    parser.add_argument('-repeat', default = 1, type=int)
+    parser.add_argument('-output', default='', type=str)
+    parser.add_argument('-baseline', default='', type=str)
+    parser.add_argument('-tolerance', default = 0.1, type=float)
+    parser.add_argument('-keep', default=False, type=lambda x: (str(x).lower() == 'true'))
+    parser.add_argument('-verbose', default=False, type=lambda x: (str(x).lower() == 'true'))
+    args, downloader_argv = parser.parse_known_args(args_other)
+
+    server, port = start_mock_server(server_args)
+    print(f'Mock server on port {port}: {vars(server_args)}')
+
+    results = []
+    try:
+        for engine in args.engines:
+            for concurrency in args.concurrency:
+                runs = [run_setting(args, engine, concurrency, port, downloader_argv) for _ in range(args.repeat)]
+                runs.sort(key=lambda run: run['images_per_s'])
+                results.append(runs[len(runs) // 2])
+                print(f'{engine} x {concurrency}: {results[-1]["images_per_s"]} images/s')
+    finally:
+        server.kill()
+        server.wait()
+
+    print_results(results)
+
+    if len(args.output) > 0:
+        write_results(results, args.output)
+
+    if len(args.baseline) > 0:
+        regressions = find_regressions(results, args.baseline, args.tolerance)
+        for engine, concurrency, before, after in regressions:
+            print(f'REGRESSION {engine} x {concurrency}: {before} -> {after} images/s')
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,206 @@
+"""
+
+    Compact class metadata for the downloader: wnid, class name, url count and flickr url count of
+    every ImageNet class, as fixed width records sorted by wnid in imagenet_class_info.bin
+
+        header      magic b'ICI2', number of classes, name width (little endian uint32)
+        records     wnid (9 bytes), class name (utf-8, padded to the name width),
+                    urls, flickr urls (little endian uint32), shared name (1 byte, 1 if other
+                    classes have the same name)
+
+    The file is memory mapped, so opening it costs nothing, a class is found by bisecting the wnids
+    and only the classes looked up are decoded. Count thresholds are applied to the whole file at
+    once through numpy, which is only imported for that. It is built from imagenet_class_info.json
+    when it is missing or older than the json, or by hand with
+
+        python class_info.py
+
+    (prepare_stats.py writes it too).
+
+"""
+
+import os
+import mmap
+import json
+import uuid
+import struct
+import logging
+import argparse
+from collections import Counter
+
+
+CURRENT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+
+CLASS_INFO_JSON_FILEPATH = os.path.join(CURRENT_FOLDER, 'imagenet_class_info.json')
+CLASS_INFO_FILEPATH = os.path.join(CURRENT_FOLDER, 'imagenet_class_info.bin')
+
+MAGIC = b'ICI2'
+HEADER = struct.Struct('<4sII')
+WNID_WIDTH = 9
+
+
+def record_struct(name_width):
+    return struct.Struct(f'<{WNID_WIDTH}s{name_width}sIIB')
+
+
+def pack_class_info(class_info_dict):
+    """ The contents of the compact file, class_info_dict as in imagenet_class_info.json,
+        wnid -> img_url_count, flickr_img_url_count, class_name """
+    wnids = sorted(class_info_dict)
+    names = [class_info_dict[wnid]['class_name'].encode('utf-8') for wnid in wnids]
+    name_width = max([len(name) for name in names] + [1])
+    record = record_struct(name_width)
+    # Folders of classes sharing a name get the wnid too, known here so the downloader never counts names
+    name_counts = Counter(names)
+
+    data = [HEADER.pack(MAGIC, len(wnids), name_width)]
+    for wnid, name in zip(wnids, names):
+        val = class_info_dict[wnid]
+        data.append(record.pack(wnid.encode('ascii'), name,
+                                int(val['img_url_count']), int(val['flickr_img_url_count']),
+                                int(name_counts[name] > 1)))
+    return b''.join(data)
+
+
+def write_class_info_file(class_info_dict, class_info_filepath=CLASS_INFO_FILEPATH):
+    # Written next to it and renamed, processes that have the old file mapped keep reading the old one.
+    # The temporary name is unique, shard processes on several hosts may build it at the same time.
+    tmp_filepath = f'{class_info_filepath}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        with open(tmp_filepath, 'wb') as class_info_f:
+            class_info_f.write(pack_class_info(class_info_dict))
+        os.replace(tmp_filepath, class_info_filepath)
+    finally:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+def build_class_info_file(class_info_json_filepath=CLASS_INFO_JSON_FILEPATH, class_info_filepath=CLASS_INFO_FILEPATH):
+    with open(class_info_json_filepath) as class_info_json_f:
+        write_class_info_file(json.load(class_info_json_f), class_info_filepath)
+
+
+class ClassInfo():
+    """ Read only mapping wnid -> dict(img_url_count, flickr_img_url_count, class_name, shared_name), like the json """
+    def __init__(self, class_info_filepath=CLASS_INFO_FILEPATH, data=None):
+        """ Maps class_info_filepath, or reads the packed records from data if given """
+        if data is not None:
+            self.mm = data
+        else:
+            with open(class_info_filepath, 'rb') as class_info_f:
+                self.mm = mmap.mmap(class_info_f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_classes, self.name_width = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{class_info_filepath} is not a class info file')
+        self.record = record_struct(self.name_width)
+
+    def offset(self, idx):
+        return HEADER.size + idx * self.record.size
+
+    def wnid_at(self, idx):
+        offset = self.offset(idx)
+        return self.mm[offset:offset + WNID_WIDTH]
+
+    def find(self, wnid):
+        """ Record index of the class, None if it is not in the file """
+        key = wnid.encode('ascii', errors='ignore')
+        lo, hi = 0, self.num_classes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.wnid_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_classes and self.wnid_at(lo) == key:
+            return lo
+        return None
+
+    def at(self, idx):
+        wnid, name, urls, flickr_urls, shared_name = self.record.unpack_from(self.mm, self.offset(idx))
+        return dict(img_url_count=urls, flickr_img_url_count=flickr_urls,
+                    class_name=name.rstrip(b'\0').decode('utf-8'), shared_name=bool(shared_name))
+
+    def get(self, wnid, default=None):
+        idx = self.find(wnid)
+        return default if idx is None else self.at(idx)
+
+    def __getitem__(self, wnid):
+        idx = self.find(wnid)
+        if idx is None:
+            raise KeyError(wnid)
+        return self.at(idx)
+
+    def __contains__(self, wnid):
+        return self.find(wnid) is not None
+
+    def __len__(self):
+        return self.num_classes
+
+    def __iter__(self):
+        for idx in range(self.num_classes):
+            yield self.wnid_at(idx).decode('ascii')
+
+    def records(self):
+        """ All records as a numpy structured array backed by the mapped file """
+        import numpy as np
+
+        dtype = np.dtype([('wnid', f'S{WNID_WIDTH}'), ('class_name', f'S{self.name_width}'),
+                          ('img_url_count', '<u4'), ('flickr_img_url_count', '<u4'), ('shared_name', 'u1')])
+        return np.frombuffer(self.mm, dtype=dtype, count=self.num_classes, offset=HEADER.size)
+
+    def select(self, count_field, factor, min_count, wnids=None):
+        """ wnids, in wnid order, of the classes whose count_field * factor is above min_count,
+            only among wnids if given """
+        import numpy as np
+
+        records = self.records()
+        mask = records[count_field] * factor > min_count
+        if wnids is not None:
+            mask &= np.isin(records['wnid'], np.array([wnid.encode('ascii') for wnid in wnids]))
+        return [wnid.decode('ascii') for wnid in records['wnid'][mask]]
+
+    def close(self):
+        if not isinstance(self.mm, mmap.mmap):
+            return
+        try:
+            self.mm.close()
+        except BufferError:
+            # A numpy view from records() is still alive, the map goes away with it
+            pass
+
+
+def class_info_file_current(class_info_filepath, class_info_json_filepath):
+    """ False if the compact file is missing, written in an older format or older than the json """
+    if not os.path.exists(class_info_filepath):
+        return False
+    if os.path.exists(class_info_json_filepath) and \
+            os.path.getmtime(class_info_json_filepath) > os.path.getmtime(class_info_filepath):
+        return False
+    with open(class_info_filepath, 'rb') as class_info_f:
+        return class_info_f.read(len(MAGIC)) == MAGIC
+
+
+def open_class_info(class_info_filepath=CLASS_INFO_FILEPATH, class_info_json_filepath=CLASS_INFO_JSON_FILEPATH):
+    """ Builds the compact file from the json if it is not current. Where it cannot be written
+        (e.g. a read only install) the records are packed in memory from the json instead. """
+    if not class_info_file_current(class_info_filepath, class_info_json_filepath):
+        print(f'Building {class_info_filepath} from {class_info_json_filepath}')
+        try:
+            build_class_info_file(class_info_json_filepath, class_info_filepath)
+        except OSError as e:
+            logging.warning(f'Could not write {class_info_filepath} ({e}), reading {class_info_json_filepath} instead')
+            with open(class_info_json_filepath) as class_info_json_f:
+                return ClassInfo(data=pack_class_info(json.load(class_info_json_f)))
+    return ClassInfo(class_info_filepath)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the compact ImageNet class metadata file')
+    parser.add_argument('-class_info_json', default=CLASS_INFO_JSON_FILEPATH, type=str)
+    parser.add_argument('-output', default=CLASS_INFO_FILEPATH, type=str)
+    args, args_other = parser.parse_known_args()
+
+    build_class_info_file(args.class_info_json, args.output)
+    print(f'Wrote {len(ClassInfo(args.output))} classes to {args.output}')
@@ -0,0 +1,231 @@
+"""
+
+    Pieces shared by the download engines: the ImageNet API url, the image
+    acceptance checks and the quota bookkeeping of a class
+
+"""
+
+import os
+import math
+import uuid
+import hashlib
+import threading
+
+
+# -api_url, {wnid} is replaced by the class, point it at mock_server.py to benchmark without the internet
+IMAGENET_API_URL = 'http://www.image-net.org/api/text/imagenet.synset.geturls?wnid={wnid}'
+IMAGENET_API_WNID_TO_URLS = lambda wnid, api_url=IMAGENET_API_URL: api_url.format(wnid=wnid)
+
+MIN_IMAGE_SIZE = 1000
+
+# Bodies are streamed to a temporary file in chunks of this size
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+
+# Quota aware scheduling: a class only gets as many urls in flight as its success rate predicts
+# are needed to fill the quota, times SUBMIT_MARGIN. Until MIN_TRIES_FOR_RATE urls of the class
+# finished, the success rate of the whole run is used instead.
+SUBMIT_MARGIN = 1.2
+MIN_TRIES_FOR_RATE = 20
+MIN_SUCCESS_RATE = 0.05
+DEFAULT_SUCCESS_RATE = 0.5
+
+
+def url_class(img_url):
+    if 'flickr' in img_url:
+        return 'is_flickr'
+    return 'not_flickr'
+
+
+def image_name_from_url(img_url):
+    img_name = img_url.split('/')[-1]
+    img_name = img_name.split("?")[0]
+    return img_name
+
+
+def check_status(status):
+    """ Returns None for a 2xx/3xx answer, otherwise the failure reason """
+    if status == 429:
+        return 'throttled'
+
+    if status >= 500:
+        return 'server error'
+
+    if status >= 400:
+        return 'http error'
+
+    return None
+
+
+def check_image_headers(headers):
+    """ Returns None if the headers announce an image, otherwise the failure reason """
+    if not 'content-type' in headers:
+        return 'no content-type'
+
+    if not 'image' in headers['content-type']:
+        return 'not an image'
+
+    return None
+
+
+def drainable(headers):
+    """ True if a rejected body is announced to be at most CHUNK_SIZE bytes. Reading it lets the
+        kept-alive connection be reused, closing the response unread closes the connection too. """
+    try:
+        return int(headers.get('content-length', '')) <= CHUNK_SIZE
+    except ValueError:
+        return False
+
+
+def check_content_length(headers, max_image_size):
+    """ Rejects from the announced Content-Length before any of the body is read """
+    try:
+        length = int(headers.get('content-length', ''))
+    except ValueError:
+        return None
+
+    if length < MIN_IMAGE_SIZE:
+        return 'too small'
+
+    if max_image_size > 0 and length > max_image_size:
+        return 'too large'
+
+    return None
+
+
+def check_image_size(size):
+    """ Returns None if the body is big enough to be a real image, otherwise the failure reason """
+    if size < MIN_IMAGE_SIZE:
+        return 'too small'
+
+    return None
+
+
+def class_folder_names(class_info_dict, wnids):
+    """ wnid -> name of its image folder for the given classes: the class name, followed by the wnid if
+        other classes share that name (like the two "crane" classes, a bird and a machine) """
+    folder_names = dict()
+    for wnid in wnids:
+        info = class_info_dict[wnid]
+        folder_names[wnid] = f'{info["class_name"]}_{wnid}' if info['shared_name'] else info['class_name']
+    return folder_names
+
+
+def partial_image_path(class_folder, img_name):
+    """ Hidden, unique temporary path the body is streamed into before it is renamed to its final name """
+    return os.path.join(class_folder, f'.{img_name}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}')
+
+
+def remove_partial_images(class_folder):
+    """ Temporary files left behind by a killed run """
+    for name in os.listdir(class_folder):
+        if name.startswith('.') and name.endswith(PARTIAL_SUFFIX):
+            os.remove(os.path.join(class_folder, name))
+
+
+def stream_to_file(chunks, file_path, max_image_size):
+    """ Writes the chunks of a body to file_path, returns (size, sha1 hex digest, failure reason or None).
+        The file is removed again if the body is rejected or reading it fails. """
+    size = 0
+    sha1 = hashlib.sha1()
+    reason = None
+    try:
+        with open(file_path, 'wb') as img_f:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_image_size > 0 and size > max_image_size:
+                    reason = 'too large'
+                    break
+                sha1.update(chunk)
+                img_f.write(chunk)
+    except BaseException:
+        os.remove(file_path)
+        raise
+
+    reason = reason or check_image_size(size)
+    if reason is not None:
+        os.remove(file_path)
+
+    return size, sha1.hexdigest(), reason
+
+
+class ClassState():
+    """ Quota and in-flight bookkeeping of one class while its urls are being processed """
+    def __init__(self, wnid, class_name, class_folder, quota):
+        self.wnid = wnid
+        self.class_name = class_name
+        self.class_folder = class_folder
+        self.quota = quota
+        self.images = 0
+        # Images stored by earlier runs, they count toward the quota but not toward the success rate
+        self.resumed = 0
+        self.tried = 0
+        self.bytes = 0
+
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.all_submitted = False
+        self.exhausted = False
+
+    def done(self):
+        return self.images >= self.quota
+
+    def resume(self, images):
+        self.images = images
+        self.resumed = images
+
+    def count_tried(self, size=0):
+        with self.lock:
+            self.tried += 1
+            self.bytes += size
+
+    def success_rate(self, run_success_rate):
+        if self.tried >= MIN_TRIES_FOR_RATE:
+            rate = (self.images - self.resumed) / self.tried
+        else:
+            rate = run_success_rate
+        return max(rate, MIN_SUCCESS_RATE)
+
+    def budget(self, run_success_rate):
+        """ How many urls of this class should be in flight at most right now """
+        missing = self.quota - self.images
+        if missing <= 0:
+            return 0
+        return int(math.ceil(missing / self.success_rate(run_success_rate) * SUBMIT_MARGIN))
+
+    def add_image(self):
+        """ Counts a saved image, returns False if the quota was already filled """
+        with self.lock:
+            if self.images >= self.quota:
+                return False
+            self.images += 1
+            return True
+
+    def remove_image(self):
+        """ Gives back an image counted by add_image that turned out not to be stored """
+        with self.lock:
+            self.images -= 1
+
+    def submit(self):
+        with self.lock:
+            self.outstanding += 1
+
+    def close(self):
+        """ Marks that no more urls will be submitted, returns True if the class is finished """
+        with self.lock:
+            self.all_submitted = True
+            return self.outstanding == 0
+
+    def task_done(self):
+        """ Returns True when the last outstanding url of a closed class is processed """
+        with self.lock:
+            self.outstanding -= 1
+            return self.all_submitted and self.outstanding == 0
+
+
+def wanted_url(img_url, scrape_only_flickr):
+    if len(img_url) <= 1:
+        return False
+    if scrape_only_flickr and url_class(img_url) == 'not_flickr':
+        return False
+    return True
@@ -0,0 +1,139 @@
+"""
+
+    Host health cache shared by the fetchers of a run.
+
+    For every hostname it keeps the recent request latencies and the number of connection
+    errors and timeouts in a row. A host that failed -dead_host_failures times in a row is
+    considered dead and its urls are skipped for -dead_host_seconds (a circuit breaker), after
+    that a single url is let through to probe it again. Request timeouts are derived from the
+    latency percentiles of the host instead of a fixed second for everyone.
+
+"""
+
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+
+DEFAULT_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 5.0
+
+# Timeout is TIMEOUT_FACTOR times the TIMEOUT_PERCENTILE latency of the host,
+# once there are at least MIN_LATENCY_SAMPLES of them
+TIMEOUT_PERCENTILE = 95
+TIMEOUT_FACTOR = 2.0
+MIN_LATENCY_SAMPLES = 10
+LATENCY_SAMPLES = 200
+
+
+def url_host(url):
+    try:
+        return urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+
+
+def percentile(values, p):
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+class HostState():
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.failures_in_row = 0
+        self.dead_until = 0
+        # The url let through to probe a host whose breaker expired, None while no probe is in flight
+        self.probe_url = None
+        self.skipped = 0
+
+
+class HostHealth():
+    def __init__(self, dead_host_failures, dead_host_seconds):
+        self.dead_host_failures = dead_host_failures
+        self.dead_host_seconds = dead_host_seconds
+
+        self.lock = threading.Lock()
+        self.hosts = dict()
+
+    def _host(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState()
+        return self.hosts[host]
+
+    def allow(self, url):
+        """ False if the host of the url is known to be dead and should not be requested """
+        if self.dead_host_failures <= 0:
+            return True
+
+        with self.lock:
+            state = self._host(url_host(url))
+            if state.dead_until == 0:
+                return True
+
+            if time.time() < state.dead_until or state.probe_url is not None:
+                state.skipped += 1
+                return False
+
+            # The breaker expired, let one request through to see if the host is back
+            state.probe_url = url
+            return True
+
+    def release(self, url):
+        """ Ends the probe of url if it finished without an answer or a connection failure,
+            e.g. it was cancelled or the url was invalid, so the next url probes the host """
+        if self.dead_host_failures <= 0:
+            return
+
+        with self.lock:
+            state = self._host(url_host(url))
+            if state.probe_url == url:
+                state.probe_url = None
+
+    def timeout(self, url):
+        with self.lock:
+            state = self._host(url_host(url))
+            if len(state.latencies) < MIN_LATENCY_SAMPLES:
+                return DEFAULT_TIMEOUT
+            timeout = percentile(state.latencies, TIMEOUT_PERCENTILE) * TIMEOUT_FACTOR
+
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, timeout))
+
+    def record_success(self, url, latency):
+        """ Any answer of the server counts, also non-image or too small ones """
+        with self.lock:
+            state = self._host(url_host(url))
+            state.latencies.append(latency)
+            state.failures_in_row = 0
+            state.dead_until = 0
+            state.probe_url = None
+
+    def record_failure(self, url, timeout=None):
+        """ Connection error, or a timeout after `timeout` seconds """
+        with self.lock:
+            state = self._host(url_host(url))
+            if timeout is not None:
+                # The real latency is unknown but at least the timeout, so slow hosts get longer timeouts
+                state.latencies.append(timeout)
+
+            state.failures_in_row += 1
+            if self.dead_host_failures > 0 and (state.probe_url is not None or state.failures_in_row >= self.dead_host_failures):
+                state.dead_until = time.time() + self.dead_host_seconds
+                state.probe_url = None
+
+    def print_stats(self, print_func):
+        with self.lock:
+            now = time.time()
+            dead = sum(1 for state in self.hosts.values() if state.dead_until > now)
+            skipped = sum(state.skipped for state in self.hosts.values())
+            hosts = len(self.hosts)
+
+        print_func(f'HOST STATS:')
+        print_func(f' {hosts} hosts seen, {dead} currently dead, {skipped} urls skipped on dead hosts')
+
+
+def make_host_health(args):
+    return HostHealth(args.dead_host_failures, args.dead_host_seconds)
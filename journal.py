@@ -0,0 +1,163 @@
+"""
+
+    Persistent download journal so that a killed run can be resumed.
+
+    The journal is an append-only SQLite log next to the downloaded images. It keeps the url
+    list of every class, an event per url (pending, success or failure with its reason) and a
+    row per finished class. On restart finished classes are skipped, url lists are not fetched
+    again and urls that already succeeded or failed for good are not requested again. Urls that
+    were throttled, got a server error, timed out or could not be written are tried again.
+
+"""
+
+import time
+import sqlite3
+import threading
+
+from ratelimit import CONGESTION_REASONS
+
+
+# Failures that say nothing about the url, it is requested again by the next run
+RETRY_REASONS = CONGESTION_REASONS + ('write error',)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_lists (wnid TEXT PRIMARY KEY, urls TEXT);
+CREATE TABLE IF NOT EXISTS url_events (id INTEGER PRIMARY KEY, wnid TEXT, url TEXT, status TEXT, reason TEXT);
+CREATE INDEX IF NOT EXISTS url_events_wnid ON url_events (wnid);
+CREATE TABLE IF NOT EXISTS finished_classes (id INTEGER PRIMARY KEY, wnid TEXT, images INTEGER, exhausted INTEGER);
+"""
+
+# Events are committed in batches, whichever limit is hit first
+COMMIT_EVERY_EVENTS = 500
+COMMIT_EVERY_SECONDS = 2.0
+
+
+class Journal():
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+    def _maybe_commit(self):
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY_EVENTS or time.time() - self.last_commit > COMMIT_EVERY_SECONDS:
+            self.conn.commit()
+            self.uncommitted = 0
+            self.last_commit = time.time()
+
+    def url_list(self, wnid):
+        """ Returns the stored url list of a class or None if it was never fetched """
+        with self.lock:
+            row = self.conn.execute('SELECT urls FROM url_lists WHERE wnid = ?', (wnid,)).fetchone()
+        if row is None:
+            return None
+        return row[0].split('\n')
+
+    def save_url_list(self, wnid, urls):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO url_lists VALUES (?, ?)', (wnid, '\n'.join(urls)))
+            self.conn.commit()
+
+    def url_states(self, wnid):
+        """ Returns {url: (status, reason)} with the last recorded event of every url of the class """
+        with self.lock:
+            rows = self.conn.execute('SELECT url, status, reason FROM url_events WHERE wnid = ? ORDER BY id',
+                                     (wnid,)).fetchall()
+        return {url: (status, reason) for url, status, reason in rows}
+
+    def finished_urls(self, wnid):
+        """ Urls that do not need to be requested again: they were saved or are known to be dead.
+            Throttled, server errors, timeouts and failed writes are tried again by the next run. """
+        return set(url for url, (status, reason) in self.url_states(wnid).items()
+                   if status != 'pending' and reason not in RETRY_REASONS)
+
+    def retryable_urls(self, wnid):
+        return set(url for url, (status, reason) in self.url_states(wnid).items()
+                   if status == 'failure' and reason in RETRY_REASONS)
+
+    def class_outcomes(self, scrape_only_flickr):
+        """ Returns {wnid: (successes, finished urls)} of every class, counting flickr urls only if scrape_only_flickr """
+        query = "SELECT wnid, SUM(status = 'success'), COUNT(*) FROM url_events WHERE status != 'pending'"
+        if scrape_only_flickr:
+            query += " AND url LIKE '%flickr%'"
+        with self.lock:
+            rows = self.conn.execute(query + ' GROUP BY wnid').fetchall()
+        return {wnid: (successes, tried) for wnid, successes, tried in rows}
+
+    def record(self, wnid, url, status, reason=None):
+        with self.lock:
+            self.conn.execute('INSERT INTO url_events (wnid, url, status, reason) VALUES (?, ?, ?, ?)',
+                              (wnid, url, status, reason))
+            self._maybe_commit()
+
+    def finish_class(self, wnid, images, exhausted):
+        with self.lock:
+            self.conn.execute('INSERT INTO finished_classes (wnid, images, exhausted) VALUES (?, ?, ?)',
+                              (wnid, images, int(exhausted)))
+            self.conn.commit()
+
+    def remove_image(self, wnid, url, reason):
+        """ An image recorded as a success was removed later. The url is recorded as failed and a class
+            finished with it is reopened with one image less, so a resumed run downloads a replacement. """
+        with self.lock:
+            self.conn.execute('INSERT INTO url_events (wnid, url, status, reason) VALUES (?, ?, ?, ?)',
+                              (wnid, url, 'failure', reason))
+            self.conn.execute('INSERT INTO finished_classes (wnid, images, exhausted)'
+                              ' SELECT wnid, images - 1, exhausted FROM finished_classes WHERE wnid = ?'
+                              ' ORDER BY id DESC LIMIT 1', (wnid,))
+            self.conn.commit()
+
+    def class_finished(self, wnid, quota):
+        """ True if the class already has its quota, or ran out of urls in an earlier run without
+            leaving urls to retry """
+        with self.lock:
+            row = self.conn.execute('SELECT images, exhausted FROM finished_classes WHERE wnid = ?'
+                                    ' ORDER BY id DESC LIMIT 1', (wnid,)).fetchone()
+        if row is None:
+            return False
+        images, exhausted = row
+        return images >= quota or (bool(exhausted) and not self.retryable_urls(wnid))
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+class NoJournal():
+    """ Stand-in used with -journal False, remembers nothing """
+    def url_list(self, wnid):
+        return None
+
+    def save_url_list(self, wnid, urls):
+        pass
+
+    def url_states(self, wnid):
+        return dict()
+
+    def finished_urls(self, wnid):
+        return set()
+
+    def class_outcomes(self, scrape_only_flickr):
+        return dict()
+
+    def record(self, wnid, url, status, reason=None):
+        pass
+
+    def finish_class(self, wnid, images, exhausted):
+        pass
+
+    def remove_image(self, wnid, url, reason):
+        pass
+
+    def class_finished(self, wnid, quota):
+        return False
+
+    def close(self):
+        pass
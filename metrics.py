@@ -0,0 +1,136 @@
+"""
+
+    Run metrics log.
+
+    A background thread samples the run every -metrics_interval seconds and appends one JSON
+    line per active class and one for the whole run (class "all") to metrics.jsonl:
+
+        {"t": 1554123456.7, "class": "n01440764", "images": 120, "images_per_s": 3.5,
+         "mb_per_s": 0.41, "in_flight": 12}
+
+    Class start and finish events are queued by the engines and written by the same thread,
+    so the download threads never touch the file. With -debug the run stats are appended to
+    stats.csv on every sample as well. metrics_report.py turns a log into throughput charts.
+
+"""
+
+import csv
+import json
+import time
+import threading
+from collections import deque
+
+
+METRICS_FILENAME = 'metrics.jsonl'
+DEBUG_CSV_FILENAME = 'stats.csv'
+
+
+class MetricsLog():
+    def __init__(self, path, interval, run_stats, debug_csv_path=None):
+        self.interval = interval
+        self.run_stats = run_stats
+        self.events = deque()
+
+        self.classes_lock = threading.Lock()
+        self.classes = dict()
+
+        self.log_f = open(path, 'a')
+
+        self.csv_f = None
+        if debug_csv_path is not None:
+            self.csv_f = open(debug_csv_path, 'a', newline='')
+            self.csv_writer = csv.writer(self.csv_f, delimiter=",")
+            self.csv_writer.writerow(run_stats.csv_header())
+
+        self.last_t = time.time()
+        self.last_all = self.run_stats.snapshot()['all']
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def event(self, wnid, event, **fields):
+        """ deque.append is thread safe, the line is written on the next flush """
+        record = {'t': time.time(), 'class': wnid, 'event': event}
+        record.update(fields)
+        self.events.append(record)
+
+    def track(self, class_state):
+        with self.classes_lock:
+            self.classes[class_state.wnid] = [class_state, class_state.images, class_state.bytes]
+        self.event(class_state.wnid, 'start', images=class_state.images)
+
+    def untrack(self, class_state):
+        with self.classes_lock:
+            self.classes.pop(class_state.wnid, None)
+        self.event(class_state.wnid, 'finish', images=class_state.images)
+
+    def sample(self):
+        now = time.time()
+        dt = max(now - self.last_t, 1e-6)
+        self.last_t = now
+
+        records = []
+        in_flight_all = 0
+        with self.classes_lock:
+            for wnid, sample in self.classes.items():
+                class_state, images, nbytes = sample
+                sample[1:] = [class_state.images, class_state.bytes]
+                in_flight_all += class_state.outstanding
+
+                records.append({'t': now, 'class': wnid, 'images': class_state.images,
+                                'images_per_s': (class_state.images - images) / dt,
+                                'mb_per_s': (class_state.bytes - nbytes) / dt / 1e6,
+                                'in_flight': class_state.outstanding})
+
+        snapshot = self.run_stats.snapshot()
+        counters = snapshot['all']
+        records.append({'t': now, 'class': 'all', 'images': counters['success'],
+                        'images_per_s': (counters['success'] - self.last_all['success']) / dt,
+                        'mb_per_s': (counters['bytes'] - self.last_all['bytes']) / dt / 1e6,
+                        'tried_per_s': (counters['tried'] - self.last_all['tried']) / dt,
+                        'in_flight': in_flight_all})
+        self.last_all = counters
+
+        if self.csv_f is not None:
+            self.csv_writer.writerow(self.run_stats.csv_row(snapshot))
+
+        return records
+
+    def flush(self, records):
+        lines = []
+        while self.events:
+            lines.append(json.dumps(self.events.popleft()))
+        lines.extend(json.dumps(record) for record in records)
+
+        self.log_f.write(''.join(line + '\n' for line in lines))
+        self.log_f.flush()
+        if self.csv_f is not None:
+            self.csv_f.flush()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush(self.sample())
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.flush(self.sample())
+        self.log_f.close()
+        if self.csv_f is not None:
+            self.csv_f.close()
+
+
+class NoMetrics():
+    """ Used when -metrics_interval is 0 """
+    def event(self, wnid, event, **fields):
+        pass
+
+    def track(self, class_state):
+        pass
+
+    def untrack(self, class_state):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,118 @@
+"""
+
+    Throughput over time of a run, from the metrics.jsonl written by the downloader.
+
+    Plots images/s, MB/s and urls in flight of the whole run and images/s of the -top_classes
+    classes with the most images, and lists the stalls: samples where urls were in flight but
+    no image was stored for at least -stall_seconds.
+
+        python metrics_report.py -metrics_log /data_root/imagenet_images/metrics.jsonl -output throughput.png
+
+"""
+
+import json
+import argparse
+from collections import defaultdict
+
+
+def read_metrics(metrics_path):
+    """ Returns the samples of the whole run and the samples per class, events are skipped """
+    run_samples = []
+    class_samples = defaultdict(list)
+
+    with open(metrics_path) as metrics_f:
+        for line in metrics_f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'event' in record:
+                continue
+            if record['class'] == 'all':
+                run_samples.append(record)
+            else:
+                class_samples[record['class']].append(record)
+
+    return run_samples, class_samples
+
+
+def find_stalls(run_samples, stall_seconds):
+    """ (start, seconds) of every stretch with urls in flight and no stored images """
+    stalls = []
+    start = None
+    for record in run_samples:
+        stalled = record['in_flight'] > 0 and record['images_per_s'] == 0
+        if stalled and start is None:
+            start = record['t']
+        elif not stalled and start is not None:
+            if record['t'] - start >= stall_seconds:
+                stalls.append((start, record['t'] - start))
+            start = None
+
+    if start is not None and run_samples[-1]['t'] - start >= stall_seconds:
+        stalls.append((start, run_samples[-1]['t'] - start))
+    return stalls
+
+
+def plot_metrics(run_samples, class_samples, top_classes, output):
+    import matplotlib
+    if output:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    t0 = run_samples[0]['t']
+    t = [record['t'] - t0 for record in run_samples]
+
+    fig, axes = plt.subplots(4, 1, sharex=True, figsize=(12, 12))
+
+    axes[0].plot(t, [record['images_per_s'] for record in run_samples])
+    axes[0].set_ylabel('images/s')
+
+    axes[1].plot(t, [record['mb_per_s'] for record in run_samples])
+    axes[1].set_ylabel('MB/s')
+
+    axes[2].plot(t, [record['in_flight'] for record in run_samples])
+    axes[2].set_ylabel('urls in flight')
+
+    biggest = sorted(class_samples, key=lambda wnid: -class_samples[wnid][-1]['images'])[:top_classes]
+    for wnid in biggest:
+        samples = class_samples[wnid]
+        axes[3].plot([record['t'] - t0 for record in samples], [record['images_per_s'] for record in samples],
+                     label=wnid)
+    axes[3].set_ylabel('images/s per class')
+    axes[3].set_xlabel('seconds')
+    if biggest:
+        axes[3].legend(loc='upper right', fontsize='small')
+
+    if output:
+        fig.savefig(output)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Throughput report of an ImageNet download run')
+    parser.add_argument('-metrics_log', required=True, type=str)
+    parser.add_argument('-output', default='', type=str)
+    parser.add_argument('-top_classes', default = 10, type=int)
+    parser.add_argument('-stall_seconds', default = 10, type=float)
+    parser.add_argument('-plot', default=True, type=lambda x: (str(x).lower() == 'true'))
+    args, args_other = parser.parse_known_args()
+
+    run_samples, class_samples = read_metrics(args.metrics_log)
+    if not run_samples:
+        print(f'No samples in {args.metrics_log}')
+        exit()
+
+    duration = run_samples[-1]['t'] - run_samples[0]['t']
+    images = run_samples[-1]['images']
+    print(f'{len(class_samples)} classes, {images} images in {duration:.0f} seconds')
+    print(f'peak {max(record["images_per_s"] for record in run_samples):.1f} images/s,'
+          f' {max(record["mb_per_s"] for record in run_samples):.2f} MB/s')
+
+    for start, seconds in find_stalls(run_samples, args.stall_seconds):
+        print(f'stalled for {seconds:.0f} seconds at {start - run_samples[0]["t"]:.0f}s')
+
+    if args.plot:
+        plot_metrics(run_samples, class_samples, args.top_classes, args.output)
@@ -0,0 +1,158 @@
+"""
+
+    Local stand-in for the ImageNet url list API and the image hosts, for benchmarks and tests
+    that must not depend on the internet.
+
+        /api?wnid=<wnid>    url list of the class, -urls_per_class urls to this server
+        /<host>/<name>      an image, or one of the simulated failures
+
+    The urls alternate between 127.0.0.1 and localhost, so the downloader sees two hosts, and all
+    contain "flickr". Every image request first waits for a latency drawn around -latency_ms,
+    then fails with probability
+
+        -error_rate        503 answer
+        -throttle_rate     429 answer
+        -timeout_rate      no answer for -hang_seconds, the downloader times out
+        -non_image_rate    an html page
+
+    or sends an image of about -payload_kb (+-50%). What happens to a url only depends on the url
+    and -seed, so repeated runs see the same server. The bodies start with the url, so every url
+    is a different image to the duplicate detection, and with -valid_jpeg True they are real JPEGs
+    (needs Pillow) for runs with -validate_images True.
+
+        python mock_server.py -port 8765 -latency_ms 50 -error_rate 0.05
+
+    and run the downloader with -api_url "http://127.0.0.1:8765/api?wnid={wnid}".
+    benchmark.py starts it by itself.
+
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+HOSTS = ['127.0.0.1', 'localhost']
+
+
+def make_jpeg(size, rng):
+    """ A noise JPEG of roughly size bytes """
+    from PIL import Image
+
+    side = max(32, int((size / 1.5) ** 0.5))
+    block = max(1, side // 16)
+    noise = Image.frombytes('RGB', (block, block), bytes(rng.getrandbits(8) for _ in range(block * block * 3)))
+    buf = io.BytesIO()
+    noise.resize((side, side)).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        args = self.server.args
+        url = urlsplit(self.path)
+        rng = random.Random(f'{args.seed}:{url.path}')
+
+        time.sleep(rng.expovariate(1000.0 / args.latency_ms) if args.latency_ms > 0 else 0)
+
+        try:
+            if url.path == '/api':
+                self.send_url_list(parse_qs(url.query).get('wnid', [''])[0])
+            else:
+                self.send_image(url.path, rng)
+        except (BrokenPipeError, ConnectionResetError):
+            # The downloader gave up on the request, e.g. after a timeout or once its quota was filled
+            pass
+
+    def send_url_list(self, wnid):
+        port = self.server.server_address[1]
+        urls = [f'http://{HOSTS[i % len(HOSTS)]}:{port}/flickr/{wnid}_{i}.jpg'
+                for i in range(self.server.args.urls_per_class)]
+        self.send_body(200, 'text/plain', '\n'.join(urls).encode('utf-8'))
+
+    def send_image(self, path, rng):
+        args = self.server.args
+        outcome = rng.random()
+
+        for rate, status in [(args.error_rate, 503), (args.throttle_rate, 429)]:
+            if outcome < rate:
+                return self.send_body(status, 'text/plain', b'')
+            outcome -= rate
+
+        if outcome < args.timeout_rate:
+            time.sleep(args.hang_seconds)
+            return self.send_body(503, 'text/plain', b'')
+        outcome -= args.timeout_rate
+
+        if outcome < args.non_image_rate:
+            return self.send_body(200, 'text/html', b'<html>not an image</html>' * 100)
+
+        size = max(1024, int(args.payload_kb * 1024 * rng.uniform(0.5, 1.5)))
+        if args.valid_jpeg:
+            body = make_jpeg(size, rng)
+        else:
+            prefix = path.encode('utf-8')
+            body = prefix + self.server.payload[:size - len(prefix)]
+        self.send_body(200, 'image/jpeg', body)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, args):
+        super().__init__(('127.0.0.1', args.port), MockHandler)
+        self.args = args
+        self.payload = os.urandom(int(args.payload_kb * 1024 * 1.5) + 1024)
+
+    def handle_error(self, request, client_address):
+        # Clients closing kept-alive connections are expected, anything else is printed as usual
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Mock ImageNet url list API and image hosts')
+    parser.add_argument('-port', default = 0, type=int)
+    parser.add_argument('-seed', default = 0, type=int)
+    parser.add_argument('-urls_per_class', default = 200, type=int)
+    parser.add_argument('-latency_ms', default = 20, type=float)
+    parser.add_argument('-payload_kb', default = 100, type=float)
+    parser.add_argument('-error_rate', default = 0.0, type=float)
+    parser.add_argument('-throttle_rate', default = 0.0, type=float)
+    parser.add_argument('-timeout_rate', default = 0.0, type=float)
+    parser.add_argument('-hang_seconds', default = 10, type=float)
+    parser.add_argument('-non_image_rate', default = 0.0, type=float)
+    parser.add_argument('-valid_jpeg', default=False, type=lambda x: (str(x).lower() == 'true'))
+    return parser
+
+
+if __name__ == '__main__':
+
+    args, args_other = build_parser().parse_known_args()
+
+    server = MockServer(args)
+    # benchmark.py waits for this line to learn the port
+    print(f'Listening on port {server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
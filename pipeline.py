@@ -0,0 +1,424 @@
+"""
+
+    Threaded download engine built as a staged pipeline:
+
+        url-list producer -> image fetcher pool -> writer
+
+    The stages are connected by bounded queues, so the url lists of the next
+    -prefetch_classes classes are fetched while the images of the current class
+    are still downloading, and every stage has its own rate limit.
+
+"""
+
+import os
+import time
+import queue
+import logging
+import sqlite3
+import threading
+
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout, TooManyRedirects, MissingSchema, \
+    InvalidURL, RequestException
+
+from sessions import make_session
+from host_health import make_host_health
+from ratelimit import make_host_rate_limiter, make_concurrency_limit
+from validate import make_validator
+from common import IMAGENET_API_WNID_TO_URLS, ClassState, url_class, image_name_from_url, \
+    check_status, check_image_headers, check_content_length, drainable, wanted_url, class_folder_names, \
+    partial_image_path, remove_partial_images, stream_to_file, CHUNK_SIZE
+
+
+class RateLimiter():
+    """ Spaces out calls to wait() so that at most `rate` of them pass per second, rate 0 disables it """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_t = time.time()
+
+    def wait(self):
+        if self.interval == 0:
+            return
+
+        with self.lock:
+            now = time.time()
+            t = max(now, self.next_t)
+            self.next_t = t + self.interval
+
+        if t > now:
+            time.sleep(t - now)
+
+
+class Pipeline():
+    def __init__(self, args, run_stats, journal, store, metrics, url_index, class_plan):
+        self.args = args
+        self.run_stats = run_stats
+        self.metrics = metrics
+        self.journal = journal
+        self.store = store
+        self.url_index = url_index
+        self.class_plan = class_plan
+        self.session = make_session(args, run_stats)
+        self.host_health = make_host_health(args)
+        self.host_limiter = make_host_rate_limiter(args)
+        self.concurrency = make_concurrency_limit(args, args.multiprocessing_workers)
+        self.validator = make_validator(args)
+
+        self.url_lists = queue.Queue(maxsize=max(1, args.prefetch_classes))
+        self.image_urls = queue.Queue(maxsize=args.multiprocessing_workers * 4)
+        self.to_write = queue.Queue(maxsize=args.multiprocessing_workers * 4)
+
+        self.url_list_limiter = RateLimiter(args.url_list_rate)
+        self.image_limiter = RateLimiter(args.image_rate)
+        self.write_limiter = RateLimiter(args.write_rate)
+
+        self.progress = threading.Condition()
+
+        self.tries_lock = threading.Lock()
+        self.url_tries = 0
+
+        # Classes between dispatch and class_finished
+        self.class_states = dict()
+
+    def count_try(self):
+        with self.tries_lock:
+            self.url_tries += 1
+            if self.url_tries % 250 == 0:
+                self.run_stats.print_report(print)
+                self.host_health.print_stats(print)
+                self.concurrency.print_stats(print)
+
+    def class_finished(self, class_state):
+        self.class_states.pop(class_state.wnid, None)
+        self.metrics.untrack(class_state)
+        self.journal.finish_class(class_state.wnid, class_state.images, class_state.exhausted and not class_state.done())
+        logging.info("[downloaded]%s:%i"%(class_state.class_name,int(self.run_stats.get("all","success"))))
+
+    def images_removed(self, removed):
+        """ Gives back the quota of stored images that turned out to be placeholders """
+        for wnid, url in removed:
+            self.journal.remove_image(wnid, url, 'placeholder')
+            class_state = self.class_states.get(wnid)
+            if class_state is not None:
+                class_state.remove_image()
+
+    def task_done(self, class_state):
+        if class_state.task_done():
+            self.class_finished(class_state)
+        with self.progress:
+            self.progress.notify()
+
+    # Stage 1: fetches url lists ahead of the fetchers, blocks once prefetch_classes lists are waiting
+    def produce_url_lists(self, classes_to_scrape, class_info_dict, imagenet_images_folder):
+
+        try:
+            for class_wnid in classes_to_scrape:
+                try:
+                    self.produce_url_list(class_wnid, class_info_dict, imagenet_images_folder)
+                except Exception:
+                    logging.exception(f'Unexpected error preparing class {class_wnid}, skipping it')
+        finally:
+            # dispatch() waits for this, also when the producer fails
+            self.url_lists.put(None)
+
+    def produce_url_list(self, class_wnid, class_info_dict, imagenet_images_folder):
+        """ Queues the url list and state of one class, or skips the class if it has no url list """
+        class_name = class_info_dict[class_wnid]["class_name"]
+
+        urls = self.journal.url_list(class_wnid)
+        if urls is None:
+            urls = self.url_index.url_list(class_wnid)
+
+        if urls is None and self.args.offline:
+            logging.error(f'Class {class_wnid} is not in the url index, skipping it in offline mode')
+            return
+
+        if urls is None:
+            self.url_list_limiter.wait()
+            try:
+                resp = self.session.get(IMAGENET_API_WNID_TO_URLS(class_wnid, self.args.api_url))
+            except RequestException as e:
+                logging.error(f'Could not fetch url list for class {class_wnid}: {e}')
+                return
+
+            # An error page is not a url list, saving it would mark the class as exhausted for good
+            if not 200 <= resp.status_code < 300:
+                logging.error(f'Could not fetch url list for class {class_wnid}: http status {resp.status_code}')
+                return
+
+            urls = [url.decode('utf-8', errors='ignore') for url in resp.content.splitlines()]
+            self.journal.save_url_list(class_wnid, urls)
+
+        class_folder = os.path.join(imagenet_images_folder, self.folder_names[class_wnid])
+        if not os.path.exists(class_folder):
+            os.mkdir(class_folder)
+
+        remove_partial_images(class_folder)
+
+        urls = [url for url in urls if wanted_url(url, self.args.scrape_only_flickr)]
+        budget = self.class_plan.url_budget(class_wnid)
+        if budget is not None:
+            urls = urls[:budget]
+
+        finished_urls = self.journal.finished_urls(class_wnid)
+        urls = [url for url in urls if url not in finished_urls]
+
+        class_state = ClassState(class_wnid, class_name, class_folder, self.class_plan.quota(class_wnid))
+        if self.args.journal:
+            class_state.resume(self.store.count_images(class_wnid, class_folder))
+
+        self.url_lists.put((class_state, urls))
+
+    # Moves urls of up to -active_classes prefetched classes into the fetcher queue. A class only
+    # gets as many urls as its quota budget allows, the rest wait until earlier urls are done.
+    def dispatch(self):
+
+        active = []
+        producer_done = False
+
+        while active or not producer_done:
+
+            while not producer_done and len(active) < self.args.active_classes:
+                try:
+                    item = self.url_lists.get(block=not active)
+                except queue.Empty:
+                    break
+                if item is None:
+                    producer_done = True
+                    break
+
+                class_state, urls = item
+                print(f'Scraping images for class \"{class_state.class_name}\"')
+                self.metrics.track(class_state)
+                self.class_states[class_state.wnid] = class_state
+                active.append((class_state, iter(urls)))
+
+            submitted = 0
+            run_success_rate = self.run_stats.success_rate()
+
+            for class_state, urls in list(active):
+
+                exhausted = class_state.done()
+                while not exhausted and class_state.outstanding < class_state.budget(run_success_rate):
+                    img_url = next(urls, None)
+                    if img_url is None:
+                        exhausted = class_state.exhausted = True
+                        break
+                    class_state.submit()
+                    self.journal.record(class_state.wnid, img_url, 'pending')
+                    self.image_urls.put((class_state, img_url))
+                    submitted += 1
+
+                if exhausted or class_state.done():
+                    active.remove((class_state, urls))
+                    if class_state.close():
+                        self.class_finished(class_state)
+
+            if submitted == 0 and active:
+                with self.progress:
+                    self.progress.wait(timeout=0.1)
+
+    # Stage 2
+    def fetch_images(self):
+
+        while True:
+            item = self.image_urls.get()
+            if item is None:
+                break
+
+            class_state, img_url = item
+            try:
+                passed_on = self.get_image(class_state, img_url)
+            except Exception:
+                logging.exception(f'Unexpected error for url {img_url}')
+                passed_on = False
+
+            if not passed_on:
+                self.task_done(class_state)
+
+    def get_image(self, class_state, img_url):
+        """ Returns True if the image was handed over to the writer """
+
+        if class_state.done():
+            return False
+
+        logging.debug(img_url)
+
+        if not self.host_health.allow(img_url):
+            logging.debug("Skipping url on dead host %s", img_url)
+            return False
+
+        try:
+            return self.fetch_image(class_state, img_url)
+        finally:
+            # A probe that got neither an answer nor a connection failure must not keep the host dead
+            self.host_health.release(img_url)
+
+    def fetch_image(self, class_state, img_url):
+        cls = url_class(img_url)
+
+        self.count_try()
+        self.image_limiter.wait()
+
+        delay = self.host_limiter.delay(img_url)
+        if delay > 0:
+            time.sleep(delay)
+
+        timeout = self.host_health.timeout(img_url)
+        t_start = time.time()
+
+        def finish(status, reason, size=0):
+            self.run_stats.finish(cls, time.time() - t_start, status, reason, size)
+            class_state.count_tried(size)
+            self.journal.record(class_state.wnid, img_url, status, reason)
+            return False
+
+        img_name = image_name_from_url(img_url)
+
+        if (len(img_name) <= 1):
+            return finish('failure', 'no file name')
+
+        size = 0
+        self.concurrency.acquire()
+        t_start = time.time()
+        try:
+            with self.session.get(img_url, timeout = timeout, stream = True) as img_resp:
+                latency = time.time() - t_start
+                self.host_health.record_success(img_url, latency)
+
+                reason = check_status(img_resp.status_code)
+                self.concurrency.record(reason, latency)
+
+                # Headers decide before the body is read, large rejected bodies are never transferred
+                reason = reason or check_image_headers(img_resp.headers) or \
+                    check_content_length(img_resp.headers, self.args.max_image_bytes)
+
+                if (reason is not None or class_state.done()) and drainable(img_resp.headers):
+                    for _ in img_resp.iter_content(CHUNK_SIZE):
+                        pass
+
+                # The quota was filled while waiting for the headers, drop the body instead of downloading it
+                if class_state.done():
+                    return False
+
+                if reason is None:
+                    partial_path = partial_image_path(class_state.class_folder, img_name)
+                    size, digest, reason = stream_to_file(img_resp.iter_content(CHUNK_SIZE), partial_path,
+                                                  self.args.max_image_bytes)
+        except ConnectTimeout:
+            logging.debug("Connect Timeout for url %s", img_url)
+            self.host_health.record_failure(img_url, timeout)
+            self.concurrency.record('connect timeout', timeout)
+            return finish('failure', 'connect timeout')
+        except ConnectionError:
+            logging.debug("Connection Error for url %s", img_url)
+            self.host_health.record_failure(img_url)
+            return finish('failure', 'connection error')
+        except ReadTimeout:
+            logging.debug("Read Timeout for url %s", img_url)
+            self.host_health.record_failure(img_url, timeout)
+            self.concurrency.record('read timeout', timeout)
+            return finish('failure', 'read timeout')
+        except TooManyRedirects:
+            logging.debug("Too many redirects %s", img_url)
+            return finish('failure', 'too many redirects')
+        except (MissingSchema, InvalidURL):
+            return finish('failure', 'invalid url')
+        except RequestException:
+            return finish('failure', 'request error')
+        finally:
+            self.concurrency.release()
+
+        if reason is None:
+            # Decoding runs in the validation processes, the fetcher only waits for the result
+            reason, img_name, size, digest = self.validator.submit(partial_path, img_name, size, digest).result()
+
+        if reason is not None:
+            logging.debug("Rejected %s: %s", img_url, reason)
+            return finish('failure', reason, size)
+
+        logging.debug('image size %s', size)
+        self.to_write.put((class_state, cls, img_url, img_name, partial_path, digest, size, time.time() - t_start))
+        return True
+
+    # Stage 3
+    def write_images(self):
+
+        while True:
+            item = self.to_write.get()
+            if item is None:
+                break
+
+            class_state, cls, img_url, img_name, partial_path, digest, size, t_spent = item
+            try:
+                # Fetches of the same class may have filled the quota while this one was queued
+                if not class_state.add_image():
+                    os.remove(partial_path)
+                    continue
+
+                self.write_limiter.wait()
+                logging.debug('Saving image %s of class %s', img_name, class_state.wnid)
+
+                rejected, removed = self.save(class_state, img_url, img_name, partial_path, digest, size)
+                self.images_removed(removed)
+                if rejected is not None:
+                    class_state.remove_image()
+                    logging.debug("Rejected %s: %s", img_url, rejected)
+                    self.run_stats.finish(cls, t_spent, 'failure', rejected, size)
+                    class_state.count_tried(size)
+                    self.journal.record(class_state.wnid, img_url, 'failure', rejected)
+                else:
+                    self.run_stats.finish(cls, t_spent, 'success', size=size)
+                    class_state.count_tried(size)
+                    self.journal.record(class_state.wnid, img_url, 'success')
+            except OSError:
+                logging.exception(f'Could not save {img_name}')
+            finally:
+                self.task_done(class_state)
+
+    def save(self, class_state, img_url, img_name, partial_path, digest, size):
+        """ store.save, a failing write rejects the image instead of losing it from the counts """
+        try:
+            return self.store.save(class_state.wnid, img_url, img_name, class_state.class_folder,
+                                   partial_path, digest, size)
+        except (OSError, sqlite3.Error):
+            logging.exception(f'Could not save {img_name}')
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return 'write error', []
+
+    def run(self, classes_to_scrape, class_info_dict, imagenet_images_folder):
+
+        self.folder_names = class_folder_names(class_info_dict, classes_to_scrape)
+
+        producer = threading.Thread(target=self.produce_url_lists,
+                                    args=(classes_to_scrape, class_info_dict, imagenet_images_folder),
+                                    daemon=True)
+        fetchers = [threading.Thread(target=self.fetch_images, daemon=True)
+                    for _ in range(self.args.multiprocessing_workers)]
+        writer = threading.Thread(target=self.write_images, daemon=True)
+
+        producer.start()
+        for fetcher in fetchers:
+            fetcher.start()
+        writer.start()
+
+        self.dispatch()
+
+        for _ in fetchers:
+            self.image_urls.put(None)
+        for fetcher in fetchers:
+            fetcher.join()
+
+        self.to_write.put(None)
+        writer.join()
+        producer.join()
+        self.session.close()
+        self.validator.close()
+
+
+def scrape_classes_pipelined(args, classes_to_scrape, class_info_dict, imagenet_images_folder, run_stats, journal,
+                             store, metrics, url_index, class_plan):
+    print(f"Multiprocessing workers: {args.multiprocessing_workers}")
+    Pipeline(args, run_stats, journal, store, metrics, url_index, class_plan).run(classes_to_scrape, class_info_dict,
+                                                                                  imagenet_images_folder)
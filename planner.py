@@ -0,0 +1,268 @@
+"""
+
+    Plans which classes to download and how many urls to spend on each, for a dataset of
+    -target_images images that is balanced uniformly or follows a given class distribution.
+
+    The expected yield of a class is its number of usable urls (flickr urls with
+    -scrape_only_flickr True) times its success rate. Success rates come from the journals of
+    earlier runs given with -history (their data roots, shard folders included). A class with
+    few finished urls is pulled toward the success rate of all history classes, weighted like
+    MIN_TRIES_FOR_RATE urls, so that a handful of lucky or unlucky urls do not decide it, and
+    without any history DEFAULT_SUCCESS_RATE is used.
+
+    Every planned class gets a url budget of images / success rate * -budget_margin urls, capped
+    at its usable urls. Download time is taken to grow with the number of urls tried, so
+    uniform plans pick the -number_of_classes classes with the smallest budgets among those
+    expected to reach their share. With -distribution classes.csv (rows of class, weight, the
+    class as wnid, ILSVRC2012 index or name) the listed classes get images in proportion to
+    their weight instead.
+
+        python planner.py -target_images 100000 -number_of_classes 100 -history /data_root_folder/imagenet
+
+    The plan is written to -output (class_plan.json) and run with
+    python downloader.py -data_root ... -class_plan class_plan.json, which downloads the planned
+    classes with their own quota and stops a class when its url budget is spent.
+
+"""
+
+import os
+import csv
+import glob
+import json
+import math
+import random
+import logging
+import argparse
+
+from common import MIN_TRIES_FOR_RATE, DEFAULT_SUCCESS_RATE
+from class_info import open_class_info, CLASS_INFO_FILEPATH, CLASS_INFO_JSON_FILEPATH
+from journal import Journal
+from resolver import get_resolver
+from sharding import SHARDS_FOLDER, STATS_FILENAME
+
+
+CLASS_PLAN_FILENAME = 'class_plan.json'
+
+BUDGET_MARGIN = 1.2
+
+
+def history_folders(data_root):
+    """ State folders of a data root: the run itself and its shards """
+    imagenet_images_folder = os.path.join(data_root, 'imagenet_images')
+    return [imagenet_images_folder] + sorted(glob.glob(os.path.join(imagenet_images_folder, SHARDS_FOLDER, 'shard-*')))
+
+
+def read_history(data_roots, scrape_only_flickr):
+    """ Returns ({wnid: [successes, finished urls]}, seconds spent per url or None) over all runs """
+    outcomes = dict()
+    time_spent = 0.0
+    tried = 0
+
+    for data_root in data_roots:
+        for folder in history_folders(data_root):
+            journal_path = os.path.join(folder, 'journal.sqlite')
+            if os.path.exists(journal_path):
+                journal = Journal(journal_path)
+                for wnid, (successes, finished) in journal.class_outcomes(scrape_only_flickr).items():
+                    class_outcomes = outcomes.setdefault(wnid, [0, 0])
+                    class_outcomes[0] += successes
+                    class_outcomes[1] += finished
+                journal.close()
+
+            stats_path = os.path.join(folder, STATS_FILENAME)
+            if os.path.exists(stats_path):
+                with open(stats_path) as stats_f:
+                    counters = json.load(stats_f)['is_flickr' if scrape_only_flickr else 'all']
+                time_spent += counters['time_spent']
+                tried += counters['tried']
+
+    return outcomes, (time_spent / tried if tried > 0 else None)
+
+
+def estimate_success_rates(wnids, outcomes):
+    """ Success rate of every class, its own history shrunk toward the rate of all history """
+    total_successes = sum(successes for successes, _ in outcomes.values())
+    total_finished = sum(finished for _, finished in outcomes.values())
+    prior_rate = total_successes / total_finished if total_finished > 0 else DEFAULT_SUCCESS_RATE
+
+    rates = dict()
+    for wnid in wnids:
+        successes, finished = outcomes.get(wnid, (0, 0))
+        rates[wnid] = (successes + prior_rate * MIN_TRIES_FOR_RATE) / (finished + MIN_TRIES_FOR_RATE)
+    return rates
+
+
+def split_target(target_images, weights):
+    """ Images per class in proportion to weights, summing to target_images exactly (largest remainder) """
+    total_weight = sum(weights)
+    shares = [target_images * weight / total_weight for weight in weights]
+    images = [int(share) for share in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda idx: images[idx] - shares[idx])
+    for idx in by_remainder[:target_images - sum(images)]:
+        images[idx] += 1
+    return images
+
+
+def url_budget(images, success_rate, available_urls, margin):
+    return min(available_urls, int(math.ceil(images / max(success_rate, 1e-6) * margin)))
+
+
+def read_distribution(distribution_path):
+    """ [(wnid, weight)] from rows of class, weight, rows without a numeric weight (a header) are skipped """
+    distribution = []
+    with open(distribution_path, newline='') as distribution_f:
+        for row in csv.reader(distribution_f):
+            if len(row) < 2:
+                continue
+            try:
+                weight = float(row[1])
+            except ValueError:
+                continue
+            distribution.append((get_resolver().resolve(row[0]), weight))
+    return distribution
+
+
+def plan_classes(class_info, candidates, weights, target_images, number_of_classes, rates, scrape_only_flickr, margin,
+                 seed=None):
+    """ Returns the planned classes as dicts, the cheapest number_of_classes candidates if weights is None """
+    count_field = 'flickr_img_url_count' if scrape_only_flickr else 'img_url_count'
+
+    def planned_class(wnid, images):
+        info = class_info[wnid]
+        return dict(wnid=wnid, class_name=info['class_name'], images=images,
+                    url_budget=url_budget(images, rates[wnid], info[count_field], margin),
+                    success_rate=round(rates[wnid], 4), available_urls=info[count_field])
+
+    if weights is not None:
+        return [planned_class(wnid, images) for wnid, images in zip(candidates, split_target(target_images, weights))]
+
+    number_of_classes = number_of_classes or len(candidates)
+    per_class = split_target(target_images, [1] * number_of_classes)
+
+    # Classes that can fill the largest share from their usable urls, cheapest (highest success rate) first
+    feasible = [wnid for wnid in candidates
+                if class_info[wnid][count_field] * rates[wnid] >= per_class[0] * margin]
+    if len(feasible) < number_of_classes:
+        raise ValueError(f'With {per_class[0]} images per class there are {len(feasible)} classes to choose from, '
+                         f'decrease -number_of_classes or -target_images')
+    # Classes without history all share the same rate, they are taken in a seeded random order
+    random.Random(seed).shuffle(feasible)
+    feasible.sort(key=lambda wnid: -rates[wnid])
+
+    return [planned_class(wnid, images) for wnid, images in zip(feasible, per_class)]
+
+
+def write_class_plan(plan, class_plan_path):
+    with open(class_plan_path, 'w') as class_plan_f:
+        json.dump(plan, class_plan_f, indent=1)
+
+
+def read_class_plan(class_plan_path):
+    if not os.path.exists(class_plan_path):
+        logging.error(f'Class plan {class_plan_path} does not exist, write it with planner.py!')
+        exit()
+    with open(class_plan_path) as class_plan_f:
+        return json.load(class_plan_f)
+
+
+class ClassPlan():
+    """ Per class quota and url budget of a plan written by planner.py """
+    def __init__(self, plan):
+        self.wnids = [planned['wnid'] for planned in plan['classes']]
+        self.classes = {planned['wnid']: planned for planned in plan['classes']}
+
+    def quota(self, wnid):
+        return self.classes[wnid]['images']
+
+    def url_budget(self, wnid):
+        return self.classes[wnid]['url_budget']
+
+
+class NoClassPlan():
+    """ Used without -class_plan, every class gets -images_per_class and all of its urls """
+    def __init__(self, images_per_class):
+        self.wnids = None
+        self.images_per_class = images_per_class
+
+    def quota(self, wnid):
+        return self.images_per_class
+
+    def url_budget(self, wnid):
+        return None
+
+
+def make_class_plan(args):
+    if len(args.class_plan) > 0:
+        return ClassPlan(read_class_plan(args.class_plan))
+    return NoClassPlan(args.images_per_class)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Plan a balanced ImageNet subset from url counts and past success rates')
+    parser.add_argument('-target_images', required=True, type=int)
+    # Uniform plans pick this many classes (0 = all candidates), -distribution plans its own classes
+    parser.add_argument('-number_of_classes', default = 0, type=int)
+    parser.add_argument('-distribution', default='', type=str)
+    # Candidates: these classes (wnids, ILSVRC2012 indices or names), else ILSVRC2012 only, else all classes
+    parser.add_argument('-class_list', default=None, nargs='*')
+    parser.add_argument('-ilsvrc2012', default=False, type=lambda x: (str(x).lower() == 'true'))
+    parser.add_argument('-scrape_only_flickr', default=True, type=lambda x: (str(x).lower() == 'true'))
+    # Data roots of earlier runs, their journals give the success rates and stats.json the time per url
+    parser.add_argument('-history', default=[], nargs='*')
+    parser.add_argument('-budget_margin', default = BUDGET_MARGIN, type=float)
+    parser.add_argument('-seed', default = None, type=int)
+    # Fetches in flight when the plan runs, only used for the time estimate
+    parser.add_argument('-multiprocessing_workers', default = 24, type=int)
+    parser.add_argument('-output', default=CLASS_PLAN_FILENAME, type=str)
+    args, args_other = parser.parse_known_args()
+
+    class_info = open_class_info(CLASS_INFO_FILEPATH, CLASS_INFO_JSON_FILEPATH)
+
+    weights = None
+    if len(args.distribution) > 0:
+        candidates, weights = zip(*read_distribution(args.distribution))
+    elif args.class_list:
+        candidates = [get_resolver().resolve(item) for item in args.class_list]
+    elif args.ilsvrc2012:
+        candidates = get_resolver().ilsvrc_wnids
+    else:
+        candidates = list(class_info)
+
+    missing = [wnid for wnid in candidates if wnid not in class_info]
+    if missing:
+        logging.warning(f'Classes {missing} have no urls in ImageNet, skipping them')
+        if weights is not None:
+            weights = [weight for wnid, weight in zip(candidates, weights) if wnid in class_info]
+        candidates = [wnid for wnid in candidates if wnid in class_info]
+
+    outcomes, seconds_per_url = read_history(args.history, args.scrape_only_flickr)
+    rates = estimate_success_rates(candidates, outcomes)
+    print(f'Success rates of {len([wnid for wnid in candidates if wnid in outcomes])} of {len(candidates)} classes'
+          f' are known from earlier runs')
+
+    try:
+        classes = plan_classes(class_info, candidates, weights, args.target_images, args.number_of_classes,
+                               rates, args.scrape_only_flickr, args.budget_margin, args.seed)
+    except ValueError as e:
+        logging.error(str(e))
+        exit()
+
+    for planned in classes:
+        expected = planned['url_budget'] * planned['success_rate']
+        if expected < planned['images']:
+            print(f'{planned["wnid"]} {planned["class_name"]}: expected {expected:.0f} of {planned["images"]} images')
+
+    urls = sum(planned['url_budget'] for planned in classes)
+    seconds = None if seconds_per_url is None else urls * seconds_per_url / args.multiprocessing_workers
+
+    write_class_plan(dict(target_images=args.target_images,
+                          distribution=args.distribution or 'uniform',
+                          scrape_only_flickr=args.scrape_only_flickr,
+                          url_budget=urls,
+                          estimated_seconds=seconds,
+                          classes=classes), args.output)
+
+    print(f'Planned {len(classes)} classes, {args.target_images} images from at most {urls} urls'
+          + ('' if seconds is None else f', about {seconds / 60:.0f} minutes with {args.multiprocessing_workers} workers'))
+    print(f'Wrote {args.output}, run it with downloader.py -class_plan {args.output}')
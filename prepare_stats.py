@@ -1,98 +1,156 @@
-import os
-import requests
-import csv
-import codecs
-import matplotlib.pyplot as plt
-import json
+"""
 
-DATA_ROOT = '/Users/martinsf/ai/deep_learning_projects/data'
-URL_WORDNET = 'http://image-net.org/archive/words.txt'
-IMAGENET_API_WNID_TO_URLS = lambda wnid: f'http://www.image-net.org/api/text/imagenet.synset.geturls?wnid={wnid}'
-
-current_folder = os.path.dirname(os.path.realpath(__file__))
+    Rebuilds imagenet_class_info.json, imagenet_class_info.bin and classes_in_imagenet.csv from the fall11 url dump
+    (http://image-net.org/imagenet_data/urls/imagenet_fall11_urls.tgz).
 
-wordnet_filename = URL_WORDNET.split('/')[-1]
-wordnet_file_path = os.path.join(current_folder, wordnet_filename)
-print(wordnet_file_path)
-if not os.path.exists(wordnet_file_path):
+    The dump is split into -chunk_mb byte ranges at line boundaries, the ranges are counted
+    by -processes worker processes reading the memory mapped file, and the per class counts
+    are merged in file order, so the output is the same as a single pass over the file.
 
-    print(f'Downloading {URL_WORDNET}')
-    resp = requests.get(URL_WORDNET)
+        python prepare_stats.py -url_list /datasets/imagenet/fall11_urls.txt
 
-    with open(wordnet_file_path, "wb") as file:
-        file.write(resp.content)
-        file.close()
+    -plot True shows histograms of the url counts, -benchmark True only measures lines/s of the
+    counting with 1 up to -processes processes.
 
-# Downloaded from http://image-net.org/imagenet_data/urls/imagenet_fall11_urls.tgz
-url_list_filepath = '/Users/martinsf/ai/datasets/imagenet/fall11_urls.txt'
-img_url_dict = dict()
+"""
 
-total_urls = 0
-flickr_urls = 0
+import os
+import csv
+import json
+import mmap
+import time
+import argparse
+import requests
+import multiprocessing
 
-#Go trough the urls list and count urls per class and flickr_urls per class, store the info in csv
-with codecs.open(url_list_filepath, 'r', encoding='utf-8', errors='ignore') as f:
-    it = 0
-    for line  in f:
-        it += 1
-        if it % 10000 == 0:
-            print(it)
-        row = line.split('\t')
+from class_info import write_class_info_file
 
-        if (len(row) != 2):
-            continue
-        id = row[0].split('_')[0]
-        url = row[1]
 
-        if not id in img_url_dict:
-            img_url_dict[id] = dict(urls = 0, flickr_urls = 0)
+URL_WORDNET = 'http://image-net.org/archive/words.txt'
 
-        img_url_dict[id]['urls'] += 1
-        total_urls += 1
-        if 'flickr' in url:
-            flickr_urls += 1
-            img_url_dict[id]['flickr_urls'] += 1
 
+def get_wordnet_file(current_folder):
+    wordnet_filename = URL_WORDNET.split('/')[-1]
+    wordnet_file_path = os.path.join(current_folder, wordnet_filename)
+    if not os.path.exists(wordnet_file_path):
 
-    wnid_to_class_dict = dict()
-    with open(wordnet_file_path, "r") as word_list_file:
-            csv_reader_word_list = csv.reader(word_list_file, delimiter='\t')
-            for row in csv_reader_word_list:
-                wnid = row[0]
-                keywords = row[1]
-                wnid_to_class_dict[wnid] = keywords
+        print(f'Downloading {URL_WORDNET}')
+        resp = requests.get(URL_WORDNET)
 
-    class_info_json_filename = 'imagenet_class_info.json'
-    class_info_json_filepath = os.path.join(current_folder, class_info_json_filename)
+        with open(wordnet_file_path, "wb") as file:
+            file.write(resp.content)
 
-    img_counts = []
-    total_url_counts = []
-    flickr_url_counts = []
+    return wordnet_file_path
 
-    class_info_dict = dict()
 
-    with open("classes_in_imagenet.csv", "w") as csv_f:
-        csv_writer  = csv.writer(csv_f, delimiter=",")
+def read_wordnet(wordnet_file_path):
+    wnid_to_class_dict = dict()
+    with open(wordnet_file_path, 'r', encoding='utf-8', errors='ignore') as word_list_file:
+        for line in word_list_file:
+            row = line.rstrip('\r\n').split('\t', 1)
+            if len(row) == 2:
+                wnid_to_class_dict[row[0]] = row[1]
+    return wnid_to_class_dict
+
+
+def chunk_ranges(url_list_filepath, chunk_bytes):
+    """ (start, end) byte ranges of about chunk_bytes, every range ends after a newline """
+    file_size = os.path.getsize(url_list_filepath)
+    ranges = []
+    with open(url_list_filepath, 'rb') as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + chunk_bytes, file_size))
+            f.readline()
+            end = min(f.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def count_chunk(task):
+    """ Counts urls and flickr urls per wnid in one byte range of the dump.
+        Returns (lines, {wnid: [urls, flickr_urls]}) with the wnids in order of appearance. """
+    url_list_filepath, start, end = task
+    counts = dict()
+    lines = 0
+
+    with open(url_list_filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in mm[start:end].split(b'\n'):
+                row = line.split(b'\t')
+                if len(row) != 2:
+                    continue
+                lines += 1
+
+                wnid = row[0].split(b'_')[0]
+                class_counts = counts.get(wnid)
+                if class_counts is None:
+                    class_counts = counts[wnid] = [0, 0]
+
+                class_counts[0] += 1
+                if b'flickr' in row[1]:
+                    class_counts[1] += 1
+
+    return lines, counts
+
+
+def count_urls(url_list_filepath, processes, chunk_bytes):
+    """ Returns (lines, {wnid: [urls, flickr_urls]}) for the whole dump """
+    tasks = [(url_list_filepath, start, end) for start, end in chunk_ranges(url_list_filepath, chunk_bytes)]
+
+    img_url_dict = dict()
+    total_lines = 0
+
+    def merge(result):
+        lines, counts = result
+        for wnid, (urls, flickr_urls) in counts.items():
+            wnid = wnid.decode('utf-8', errors='ignore')
+            if wnid not in img_url_dict:
+                img_url_dict[wnid] = [0, 0]
+            img_url_dict[wnid][0] += urls
+            img_url_dict[wnid][1] += flickr_urls
+        return lines
+
+    if processes <= 1:
+        for task in tasks:
+            total_lines += merge(count_chunk(task))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            # imap keeps the chunks in file order, so classes keep the order of the dump
+            for result in pool.imap(count_chunk, tasks):
+                total_lines += merge(result)
+
+    return total_lines, img_url_dict
+
+
+def write_class_info(img_url_dict, wnid_to_class_dict, class_info_json_filepath, classes_csv_filepath):
+    """ Writes both files class by class instead of building the whole json in memory first """
+    with open(classes_csv_filepath, "w", newline='') as csv_f, open(class_info_json_filepath, "w") as class_info_json_f:
+        csv_writer = csv.writer(csv_f, delimiter=",")
         csv_writer.writerow(["synid", "class_name", "urls", "flickr_urls"])
 
-        for key, val in img_url_dict.items():
-            class_info_dict[key] = dict(
-                img_url_count = val['urls'],
-                flickr_img_url_count = val['flickr_urls'],
-                class_name = wnid_to_class_dict[key].split(',')[0]
-            )
-            print(f'{wnid_to_class_dict[key]} {len(val)}')
-            total_url_counts.append(val['urls'])
-            csv_writer.writerow([key, wnid_to_class_dict[key].split(',')[0], val['urls'], val["flickr_urls"]])
+        class_info_json_f.write('{')
+        for idx, (key, (urls, flickr_urls)) in enumerate(img_url_dict.items()):
+            class_name = wnid_to_class_dict.get(key, key).split(',')[0]
 
-            flickr_url_counts.append(val['flickr_urls'])
+            if idx > 0:
+                class_info_json_f.write(', ')
+            class_info_json_f.write(json.dumps(key) + ': ' + json.dumps(dict(
+                img_url_count = urls,
+                flickr_img_url_count = flickr_urls,
+                class_name = class_name
+            )))
 
+            csv_writer.writerow([key, class_name, urls, flickr_urls])
+        class_info_json_f.write('}')
 
-    with open(class_info_json_filepath,"w") as class_info_json_f:
-        json.dump(class_info_dict, class_info_json_f)
-        csv_writer = csv.writer(class_info_json_f, delimiter=';')
 
-    print(f'In total there are {total_urls} img urls and {flickr_urls} flickr urls')
+def plot_url_counts(img_url_dict):
+    import matplotlib.pyplot as plt
+
+    total_url_counts = [urls for urls, _ in img_url_dict.values()]
+    flickr_url_counts = [flickr_urls for _, flickr_urls in img_url_dict.values()]
 
     fig, axs = plt.subplots(3,1)
     plt.style.use('seaborn')
@@ -117,4 +175,59 @@ with codecs.open(url_list_filepath, 'r', encoding='utf-8', errors='ignore') as f
     axs[2].set_xlabel("Images per class")
     axs[2].set_ylabel("Number of classes")
 
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+
+def benchmark(url_list_filepath, max_processes, chunk_bytes):
+    processes = 1
+    while True:
+        t_start = time.time()
+        lines, _ = count_urls(url_list_filepath, processes, chunk_bytes)
+        t_spent = time.time() - t_start
+        print(f'{processes} processes: {lines} lines in {t_spent:.2f} seconds, {lines / t_spent:.0f} lines/s')
+
+        if processes >= max_processes:
+            break
+        processes = min(processes * 2, max_processes)
+
+
+if __name__ == '__main__':
+
+    current_folder = os.path.dirname(os.path.realpath(__file__))
+
+    parser = argparse.ArgumentParser(description='Count ImageNet urls per class from the fall11 url dump')
+    parser.add_argument('-url_list', required=True, type=str)
+    parser.add_argument('-output_folder', default=current_folder, type=str)
+    parser.add_argument('-processes', default=multiprocessing.cpu_count(), type=int)
+    parser.add_argument('-chunk_mb', default = 64, type=int)
+    parser.add_argument('-plot', default=False, type=lambda x: (str(x).lower() == 'true'))
+    parser.add_argument('-benchmark', default=False, type=lambda x: (str(x).lower() == 'true'))
+    args, args_other = parser.parse_known_args()
+
+    chunk_bytes = args.chunk_mb * 1024 * 1024
+
+    if args.benchmark:
+        benchmark(args.url_list, args.processes, chunk_bytes)
+        exit()
+
+    wnid_to_class_dict = read_wordnet(get_wordnet_file(current_folder))
+
+    t_start = time.time()
+    total_lines, img_url_dict = count_urls(args.url_list, args.processes, chunk_bytes)
+    t_spent = time.time() - t_start
+    print(f'Counted {total_lines} lines in {t_spent:.2f} seconds, {total_lines / max(t_spent, 1e-6):.0f} lines/s')
+
+    write_class_info(img_url_dict, wnid_to_class_dict,
+                     os.path.join(args.output_folder, 'imagenet_class_info.json'),
+                     os.path.join(args.output_folder, 'classes_in_imagenet.csv'))
+    write_class_info_file({key: dict(img_url_count=urls, flickr_img_url_count=flickr_urls,
+                                     class_name=wnid_to_class_dict.get(key, key).split(',')[0])
+                           for key, (urls, flickr_urls) in img_url_dict.items()},
+                          os.path.join(args.output_folder, 'imagenet_class_info.bin'))
+
+    total_urls = sum(urls for urls, _ in img_url_dict.values())
+    flickr_urls = sum(flickr_urls for _, flickr_urls in img_url_dict.values())
+    print(f'In total there are {total_urls} img urls and {flickr_urls} flickr urls')
+
+    if args.plot:
+        plot_url_counts(img_url_dict)
@@ -0,0 +1,201 @@
+"""
+
+    Request rate limits and adaptive concurrency for the image fetches.
+
+    HostRateLimiter keeps a token bucket per hostname, so no single host (flickr farms
+    share a few) gets more than -host_rate requests per second on average, with bursts
+    of up to -host_burst requests.
+
+    With -adaptive_concurrency True the number of fetches in flight is not fixed but
+    steered AIMD style, like TCP congestion control: it starts at -min_concurrency, grows
+    by one for every window of `limit` fast successful fetches and is halved on throttling
+    (429), server errors (5xx) or timeouts, at most once per BACKOFF_COOLDOWN seconds.
+    -multiprocessing_workers (threads) or -async_max_connections (asyncio) is the maximum.
+
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+
+from host_health import url_host
+
+
+# Failure reasons that mean the servers are overloaded or throttling us
+CONGESTION_REASONS = ('throttled', 'server error', 'read timeout', 'connect timeout')
+
+DECREASE_FACTOR = 0.5
+BACKOFF_COOLDOWN = 1.0
+
+# A fetch slower than this many times the fastest average latency seen is not counted as healthy
+SLOW_LATENCY_FACTOR = 3.0
+LATENCY_SMOOTHING = 0.1
+
+
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.t = time.time()
+
+    def reserve(self):
+        """ Takes a token, returns how many seconds the caller has to wait before using it """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class HostRateLimiter():
+    """ A token bucket per host, rate 0 disables it """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = dict()
+
+    def delay(self, url):
+        if self.rate <= 0:
+            return 0
+
+        host = url_host(url)
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host].reserve()
+
+
+class AIMD():
+    """ Additive increase / multiplicative decrease of a concurrency limit """
+    def __init__(self, min_limit, max_limit):
+        self.min_limit = max(1, min(min_limit, max_limit))
+        self.max_limit = max_limit
+        self.limit = float(self.min_limit)
+        self.in_use = 0
+
+        self.latency = None
+        self.best_latency = None
+        self.last_backoff = 0
+        self.backoffs = 0
+
+    def record(self, reason, latency):
+        """ Feeds the outcome of a fetch, reason None is a success """
+        if reason in CONGESTION_REASONS:
+            now = time.time()
+            if now - self.last_backoff >= BACKOFF_COOLDOWN:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.last_backoff = now
+                self.backoffs += 1
+            return
+
+        if reason is not None:
+            return
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+
+        if self.latency <= self.best_latency * SLOW_LATENCY_FACTOR:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def print_stats(self, print_func):
+        print_func(f'CONCURRENCY STATS:')
+        print_func(f' limit {int(self.limit)} of {self.max_limit}, {self.in_use} in flight, {self.backoffs} backoffs')
+
+
+class ConcurrencyLimit(AIMD):
+    """ Blocking gate for the fetcher threads """
+    def __init__(self, min_limit, max_limit):
+        super().__init__(min_limit, max_limit)
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_use >= int(self.limit):
+                self.condition.wait()
+            self.in_use += 1
+
+    def release(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
+
+    def record(self, reason, latency):
+        with self.condition:
+            super().record(reason, latency)
+            self.condition.notify_all()
+
+
+class AsyncConcurrencyLimit(AIMD):
+    """ Gate for the asyncio engine. Only acquire awaits, so a cancelled fetch can always release. """
+    def __init__(self, min_limit, max_limit):
+        super().__init__(min_limit, max_limit)
+        self.waiters = deque()
+
+    async def acquire(self):
+        while self.in_use >= int(self.limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self.waiters.append(waiter)
+            await waiter
+        self.in_use += 1
+
+    def wake(self):
+        free = int(self.limit) - self.in_use
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def release(self):
+        self.in_use -= 1
+        self.wake()
+
+    def record(self, reason, latency):
+        super().record(reason, latency)
+        self.wake()
+
+
+class NoConcurrencyLimit():
+    """ Used without -adaptive_concurrency, the fixed worker / connection count is the limit """
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def record(self, reason, latency):
+        pass
+
+    def print_stats(self, print_func):
+        pass
+
+
+class AsyncNoConcurrencyLimit(NoConcurrencyLimit):
+    async def acquire(self):
+        pass
+
+
+def make_host_rate_limiter(args):
+    return HostRateLimiter(args.host_rate, args.host_burst)
+
+
+def make_concurrency_limit(args, max_limit):
+    if not args.adaptive_concurrency:
+        return NoConcurrencyLimit()
+    return ConcurrencyLimit(args.min_concurrency, max_limit)
+
+
+def make_async_concurrency_limit(args, max_limit):
+    if not args.adaptive_concurrency:
+        return AsyncNoConcurrencyLimit()
+    return AsyncConcurrencyLimit(args.min_concurrency, max_limit)
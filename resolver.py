@@ -0,0 +1,189 @@
+"""
+
+    Resolves ImageNet classes between wnid, ILSVRC2012 class index and class names.
+
+    The 1000 ILSVRC2012 classes are precomputed in ilsvrc2012_classes.csv (index, wnid, names)
+    from Imagenet_classes (index -> names) and words.txt (wnid -> names). A name list of
+    Imagenet_classes is matched as a whole against words.txt, not synonym by synonym, and
+    homonyms ("crane" the bird and the machine) are told apart by the ILSVRC order: class
+    indices follow the sorted wnids. The few homonyms that are neighbours in wnid order too
+    are pinned in ILSVRC_WNIDS. Rebuild the csv with
+
+        python resolver.py -build True
+
+    Lookups are dicts, in both directions:
+
+        resolver = get_resolver()
+        resolver.wnid(0)              'n01440764'
+        resolver.index('n01440764')   0
+        resolver.names('n01440764')   ['tench', 'Tinca tinca']
+        resolver.resolve('goldfish')  'n01443537'
+
+"""
+
+import os
+import ast
+import csv
+import argparse
+
+
+CURRENT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+
+WORDS_FILEPATH = os.path.join(CURRENT_FOLDER, 'words.txt')
+IMAGENET_CLASSES_FILEPATH = os.path.join(CURRENT_FOLDER, 'Imagenet_classes')
+ILSVRC_CLASSES_FILEPATH = os.path.join(CURRENT_FOLDER, 'ilsvrc2012_classes.csv')
+
+NUM_ILSVRC_CLASSES = 1000
+
+# Homonyms whose wnids are next to each other, so the ILSVRC order does not tell them apart
+ILSVRC_WNIDS = {
+    102: 'n01872401', 398: 'n02666196', 411: 'n02730930', 417: 'n02782093', 431: 'n02804414',
+    438: 'n02815834', 443: 'n02834397', 456: 'n02879718', 471: 'n02950826', 488: 'n02999410',
+    501: 'n03045698', 544: 'n03259280', 549: 'n03291819', 586: 'n03478589', 587: 'n03481172',
+    594: 'n03495258', 597: 'n03527444', 624: 'n03661043', 643: 'n03724870', 664: 'n03782006',
+    698: 'n03877845', 718: 'n03933933', 727: 'n03956157', 733: 'n03976657', 745: 'n04009552',
+    753: 'n04040759', 758: 'n04067472', 766: 'n04111531', 771: 'n04125021', 780: 'n04147183',
+    783: 'n04153751', 792: 'n04208210', 813: 'n04270147', 815: 'n04275548', 816: 'n04277352',
+    830: 'n04336792', 866: 'n04465501', 902: 'n04579432', 910: 'n04597913', 982: 'n10148035',
+    987: 'n12144580',
+}
+
+
+def split_names(names):
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+def read_words(words_filepath=WORDS_FILEPATH):
+    """ wnid -> comma separated names """
+    wnid_to_names = dict()
+    with open(words_filepath, encoding='utf-8', errors='ignore') as words_f:
+        for line in words_f:
+            row = line.rstrip('\r\n').split('\t', 1)
+            if len(row) == 2:
+                wnid_to_names[row[0]] = row[1]
+    return wnid_to_names
+
+
+def build_ilsvrc_classes(words_filepath=WORDS_FILEPATH, imagenet_classes_filepath=IMAGENET_CLASSES_FILEPATH):
+    """ Returns the wnids of the ILSVRC2012 classes, by class index """
+    with open(imagenet_classes_filepath) as classes_f:
+        index_to_names = ast.literal_eval(classes_f.read())
+
+    names_to_wnids = dict()
+    for wnid, names in read_words(words_filepath).items():
+        names_to_wnids.setdefault(names, []).append(wnid)
+
+    candidates = [sorted(names_to_wnids.get(index_to_names[idx], [])) for idx in range(NUM_ILSVRC_CLASSES)]
+    wnids = [ILSVRC_WNIDS.get(idx) or (found[0] if len(found) == 1 else None) for idx, found in enumerate(candidates)]
+
+    # Every pass settles the classes whose candidates fit between the wnids of their settled neighbours
+    changed = True
+    while changed:
+        changed = False
+        for idx in range(NUM_ILSVRC_CLASSES):
+            if wnids[idx] is not None:
+                continue
+            lower = next((wnid for wnid in reversed(wnids[:idx]) if wnid is not None), '')
+            upper = next((wnid for wnid in wnids[idx + 1:] if wnid is not None), '~')
+            fitting = [wnid for wnid in candidates[idx] if lower < wnid < upper]
+            if len(fitting) == 1:
+                wnids[idx] = fitting[0]
+                changed = True
+
+    unresolved = [idx for idx, wnid in enumerate(wnids) if wnid is None]
+    if unresolved:
+        raise ValueError(f'Could not resolve the wnids of ILSVRC classes {unresolved}')
+
+    return wnids
+
+
+def write_ilsvrc_classes(wnids, ilsvrc_classes_filepath=ILSVRC_CLASSES_FILEPATH, words_filepath=WORDS_FILEPATH):
+    wnid_to_names = read_words(words_filepath)
+    with open(ilsvrc_classes_filepath, 'w', newline='') as csv_f:
+        csv_writer = csv.writer(csv_f)
+        csv_writer.writerow(['index', 'wnid', 'names'])
+        for idx, wnid in enumerate(wnids):
+            csv_writer.writerow([idx, wnid, wnid_to_names[wnid]])
+
+
+class Resolver():
+    def __init__(self, ilsvrc_classes_filepath=ILSVRC_CLASSES_FILEPATH, words_filepath=WORDS_FILEPATH):
+        self.words_filepath = words_filepath
+        self.wnid_to_names = None
+
+        self.ilsvrc_wnids = []
+        self.wnid_to_index = dict()
+        self.ilsvrc_names = dict()
+        self.name_to_wnids = dict()
+
+        with open(ilsvrc_classes_filepath, newline='') as csv_f:
+            for idx, wnid, names in list(csv.reader(csv_f))[1:]:
+                self.ilsvrc_wnids.append(wnid)
+                self.wnid_to_index[wnid] = int(idx)
+                self.ilsvrc_names[wnid] = split_names(names)
+                for name in self.ilsvrc_names[wnid]:
+                    self.name_to_wnids.setdefault(name.lower(), []).append(wnid)
+
+    def wnid(self, index):
+        return self.ilsvrc_wnids[index]
+
+    def index(self, wnid):
+        """ ILSVRC2012 class index, None for classes that are not part of it """
+        return self.wnid_to_index.get(wnid)
+
+    def names(self, wnid):
+        if wnid in self.ilsvrc_names:
+            return self.ilsvrc_names[wnid]
+
+        # All of words.txt is only read for classes outside of ILSVRC2012
+        if self.wnid_to_names is None:
+            self.wnid_to_names = read_words(self.words_filepath)
+        return split_names(self.wnid_to_names.get(wnid, ''))
+
+    def wnids_for_name(self, name):
+        """ ILSVRC2012 classes that have name as one of their synonyms """
+        return self.name_to_wnids.get(name.lower(), [])
+
+    def resolve(self, token):
+        """ wnid of a wnid, an ILSVRC2012 index or an unambiguous ILSVRC2012 class name """
+        token = str(token).strip()
+        if token.startswith('n') and token[1:].isdigit():
+            return token
+
+        if token.isdigit():
+            return self.wnid(int(token))
+
+        wnids = self.wnids_for_name(token)
+        if len(wnids) != 1:
+            raise KeyError(f'{token} matches {len(wnids)} ILSVRC2012 classes {wnids}, use the wnid or index instead')
+        return wnids[0]
+
+
+resolver = None
+
+
+def get_resolver():
+    global resolver
+    if resolver is None:
+        resolver = Resolver()
+    return resolver
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Resolve ImageNet classes between wnid, ILSVRC2012 index and name')
+    parser.add_argument('-build', default=False, type=lambda x: (str(x).lower() == 'true'))
+    parser.add_argument('classes', nargs='*')
+    args, args_other = parser.parse_known_args()
+
+    if args.build:
+        write_ilsvrc_classes(build_ilsvrc_classes())
+        print(f'Wrote {ILSVRC_CLASSES_FILEPATH}')
+
+    for token in args.classes:
+        try:
+            wnid = get_resolver().resolve(token)
+        except KeyError as e:
+            print(e.args[0])
+            continue
+        print(f'{wnid} {get_resolver().index(wnid)} {", ".join(get_resolver().names(wnid))}')
@@ -0,0 +1,64 @@
+"""
+
+    Pooled http sessions for the threaded engine.
+
+    All fetcher threads share one requests.Session, so connections to the handful of flickr
+    farm hosts are kept alive and reused instead of paying the TCP/TLS handshake for every
+    image. The pool of each host holds at most -max_connections_per_host connections and
+    the pools count how many connections they hand out and how many they had to open.
+
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# How many per-host pools are kept around before the least recently used one is dropped
+POOL_HOSTS = 100
+
+
+def counting_pool_class(pool_class, run_stats):
+
+    # urllib3 keeps connection objects in the pool and reconnects them when the server dropped
+    # the socket, so new connections are counted where the socket is actually opened
+    class CountingConnection(pool_class.ConnectionCls):
+        def connect(self):
+            run_stats.inc('connections', 'new', 1)
+            return super().connect()
+
+    class CountingPool(pool_class):
+        ConnectionCls = CountingConnection
+
+        def _get_conn(self, timeout=None):
+            run_stats.inc('connections', 'checkouts', 1)
+            return super()._get_conn(timeout=timeout)
+
+    return CountingPool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, run_stats, **kwargs):
+        self.run_stats = run_stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            http=counting_pool_class(HTTPConnectionPool, self.run_stats),
+            https=counting_pool_class(HTTPSConnectionPool, self.run_stats),
+        )
+
+
+def make_session(args, run_stats):
+    """ Session shared by all fetcher threads, one pool per host sized to the number of workers """
+    pool_size = min(args.multiprocessing_workers, args.max_connections_per_host)
+
+    # pool_block makes threads wait for a free connection instead of opening extra ones,
+    # which is what caps the connections per host
+    adapter = PooledAdapter(run_stats, pool_connections=POOL_HOSTS, pool_maxsize=pool_size, pool_block=True)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
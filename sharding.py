@@ -0,0 +1,166 @@
+"""
+
+    Splitting a run into shards that can run in parallel, as local processes or on other hosts.
+
+    The run that picks the classes writes plan.json into imagenet_images: the picked classes,
+    split into -num_shards shards, deterministically for a given -seed. Every shard process is
+    started with the same arguments plus -shard_index and scrapes only its classes. Class
+    folders are disjoint between shards, all other state (journal, content index, tar shards,
+    stats and manifest) goes to imagenet_images/run_shards/shard-<i>/.
+
+    When all shards are done, merge_shards sums their stats.json into imagenet_images/stats.json,
+    concatenates their manifest.csv into imagenet_images/manifest.csv and, if tar shards were
+    written, their index.csv into imagenet_images/index.csv (readable with shards.ShardReader).
+    -launch_shards True does all of this on the local machine, or run
+
+        python sharding.py -data_root /data_root_folder/imagenet
+
+    after the shards on the other hosts finished.
+
+"""
+
+import os
+import sys
+import csv
+import json
+import random
+import logging
+import argparse
+import subprocess
+
+from stats import add_snapshots
+
+
+PLAN_FILENAME = 'plan.json'
+MANIFEST_FILENAME = 'manifest.csv'
+STATS_FILENAME = 'stats.json'
+SHARD_INDEX_FILENAME = 'index.csv'
+SHARDS_FOLDER = 'run_shards'
+
+
+def plan_shards(classes_to_scrape, num_shards, seed):
+    """ Deals the classes out round robin after a seeded shuffle, the plan only depends on the set of classes and seed """
+    order = sorted(classes_to_scrape)
+    random.Random(seed if seed is not None else 0).shuffle(order)
+
+    shards = [order[i::num_shards] for i in range(num_shards)]
+    return dict(num_shards=num_shards, seed=seed, shards=shards)
+
+
+def write_plan(imagenet_images_folder, plan):
+    with open(os.path.join(imagenet_images_folder, PLAN_FILENAME), 'w') as plan_f:
+        json.dump(plan, plan_f, indent=1)
+
+
+def read_plan(imagenet_images_folder):
+    plan_path = os.path.join(imagenet_images_folder, PLAN_FILENAME)
+    if not os.path.exists(plan_path):
+        logging.error(f'No shard plan in {plan_path}, run once with -num_shards to create it!')
+        exit()
+
+    with open(plan_path) as plan_f:
+        return json.load(plan_f)
+
+
+def shard_state_folder(imagenet_images_folder, shard_index):
+    state_folder = os.path.join(imagenet_images_folder, SHARDS_FOLDER, f'shard-{shard_index:03d}')
+    os.makedirs(state_folder, exist_ok=True)
+    return state_folder
+
+
+def shard_argv(args):
+    """ Downloader arguments of the shard processes, built from the parsed arguments instead of
+        sys.argv so that defaults set by a wrapper like LVSRC.py reach the shards too """
+    argv = []
+    for key, value in vars(args).items():
+        if value is None or key in ('shard_index', 'launch_shards'):
+            continue
+        argv.append(f'-{key}')
+        argv += [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    return argv
+
+
+def launch_shards(num_shards, argv):
+    """ Runs every shard of the plan as its own downloader process with argv and waits for all of them """
+    downloader_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'downloader.py')
+
+    processes = []
+    for shard_index in range(num_shards):
+        cmd = [sys.executable, downloader_path] + argv + ['-shard_index', str(shard_index)]
+        processes.append(subprocess.Popen(cmd))
+
+    for shard_index, process in enumerate(processes):
+        if process.wait() != 0:
+            logging.error(f'Shard {shard_index} exited with code {process.returncode}')
+
+
+def merge_csv(csv_paths, merged_path, row_func=None):
+    """ Concatenates csv files with the same header, returns the number of rows written """
+    rows = 0
+    with open(merged_path, 'w', newline='') as merged_f:
+        csv_writer = csv.writer(merged_f)
+        header_written = False
+
+        for csv_path in csv_paths:
+            with open(csv_path, newline='') as csv_f:
+                csv_reader = csv.reader(csv_f)
+                header = next(csv_reader, None)
+                if header is None:
+                    continue
+                if not header_written:
+                    csv_writer.writerow(header)
+                    header_written = True
+                for row in csv_reader:
+                    csv_writer.writerow(row if row_func is None else row_func(csv_path, row))
+                    rows += 1
+    return rows
+
+
+def merge_shards(imagenet_images_folder):
+    shards_root = os.path.join(imagenet_images_folder, SHARDS_FOLDER)
+    if not os.path.isdir(shards_root):
+        logging.error(f'No shard runs in {shards_root}')
+        return None
+
+    state_folders = [os.path.join(shards_root, name) for name in sorted(os.listdir(shards_root))]
+
+    total_stats = dict()
+    for state_folder in state_folders:
+        stats_path = os.path.join(state_folder, STATS_FILENAME)
+        if os.path.exists(stats_path):
+            with open(stats_path) as stats_f:
+                add_snapshots(total_stats, json.load(stats_f))
+        else:
+            print(f'{state_folder} has no {STATS_FILENAME}, the shard did not finish')
+
+    with open(os.path.join(imagenet_images_folder, STATS_FILENAME), 'w') as stats_f:
+        json.dump(total_stats, stats_f)
+
+    manifests = [os.path.join(folder, MANIFEST_FILENAME) for folder in state_folders
+                 if os.path.exists(os.path.join(folder, MANIFEST_FILENAME))]
+    images = merge_csv(manifests, os.path.join(imagenet_images_folder, MANIFEST_FILENAME))
+
+    # Shard file names in the merged index are relative to imagenet_images
+    def relative_shard(index_path, row):
+        shards_dir = os.path.relpath(os.path.dirname(index_path), imagenet_images_folder)
+        row[2] = os.path.join(shards_dir, row[2])
+        return row
+
+    shard_indexes = [os.path.join(folder, 'shards', SHARD_INDEX_FILENAME) for folder in state_folders
+                     if os.path.exists(os.path.join(folder, 'shards', SHARD_INDEX_FILENAME))]
+    if shard_indexes:
+        merge_csv(shard_indexes, os.path.join(imagenet_images_folder, SHARD_INDEX_FILENAME), relative_shard)
+
+    all_stats = total_stats.get('all', dict())
+    print(f'Merged {len(state_folders)} shards: {images} images,'
+          f' {all_stats.get("success", 0)} successes out of {all_stats.get("tried", 0)} tried urls')
+    return total_stats
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Merge stats and manifests of a sharded ImageNet download')
+    parser.add_argument('-data_root', required=True, type=str)
+    args, args_other = parser.parse_known_args()
+
+    merge_shards(os.path.join(args.data_root, 'imagenet_images'))
@@ -0,0 +1,207 @@
+"""
+
+    Sharded tar output, an alternative to millions of small image files.
+
+    Accepted images are appended to fixed-size, uncompressed tar shards in the WebDataset
+    convention: every sample is a `<key>.<ext>` image member followed by a `<key>.cls`
+    member holding the wnid. Next to the shards, index.csv has one row per sample
+
+        key, wnid, shard, offset, length, sha1
+
+    where offset/length locate the image bytes inside the shard, so a training reader can
+    either stream the tars sequentially or mmap them and slice images out directly.
+
+    Usage of the reader:
+
+        python shards.py -shards_dir /data_root/imagenet_images/shards
+
+"""
+
+import io
+import os
+import csv
+import mmap
+import logging
+import tarfile
+import argparse
+import threading
+from collections import Counter
+
+
+INDEX_FILENAME = 'index.csv'
+INDEX_HEADER = ['key', 'wnid', 'shard', 'offset', 'length', 'sha1']
+
+
+def shard_name(shard_number):
+    return f'shard-{shard_number:06d}.tar'
+
+
+class ShardWriter():
+    def __init__(self, shards_dir, max_shard_bytes):
+        self.shards_dir = shards_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(shards_dir, exist_ok=True)
+
+        # Shards of earlier runs are left alone, a killed run may have left the last one truncated
+        existing = [name for name in os.listdir(shards_dir) if name.startswith('shard-') and name.endswith('.tar')]
+        self.shard_number = len(existing)
+        self.tar = None
+        self.tar_name = None
+
+        index_path = os.path.join(shards_dir, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            self._drop_truncated_samples(index_path)
+        else:
+            self._write_index(index_path, [INDEX_HEADER])
+        self._open_index(index_path)
+
+    def _open_index(self, index_path):
+        self.index_f = open(index_path, 'a', newline='')
+        self.index_writer = csv.writer(self.index_f)
+
+    def _write_index(self, index_path, rows):
+        with open(index_path + '.tmp', 'w', newline='') as index_f:
+            csv.writer(index_f).writerows(rows)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _drop_truncated_samples(self, index_path):
+        """ A killed run can have indexed samples whose bytes never reached the shard, they are left out """
+        with open(index_path, newline='') as index_f:
+            rows = list(csv.reader(index_f))
+
+        shard_sizes = dict()
+        kept = rows[:1]
+        for row in rows[1:]:
+            key, wnid, shard, offset, length, sha1 = row
+            if shard not in shard_sizes:
+                shard_path = os.path.join(self.shards_dir, shard)
+                shard_sizes[shard] = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+            if int(offset) + int(length) <= shard_sizes[shard]:
+                kept.append(row)
+
+        if len(kept) < len(rows):
+            logging.warning(f'Dropping {len(rows) - len(kept)} samples of truncated shards from {index_path}')
+            self._write_index(index_path, kept)
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        self.tar_name = shard_name(self.shard_number)
+        self.shard_number += 1
+        self.tar = tarfile.open(os.path.join(self.shards_dir, self.tar_name), 'w', format=tarfile.USTAR_FORMAT)
+
+    def _add_member(self, name, fileobj, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        self.tar.addfile(info, fileobj)
+
+        # The data of the member ends at the current offset, padded to full tar blocks
+        blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+        if remainder:
+            blocks += 1
+        return self.tar.offset - blocks * tarfile.BLOCKSIZE
+
+    def add(self, key, wnid, digest, file_path, ext):
+        size = os.path.getsize(file_path)
+        with self.lock:
+            if self.tar is None or self.tar.offset >= self.max_shard_bytes:
+                self._next_shard()
+
+            with open(file_path, 'rb') as img_f:
+                offset = self._add_member(key + ext, img_f, size)
+
+            cls_data = wnid.encode('utf-8')
+            self._add_member(key + '.cls', io.BytesIO(cls_data), len(cls_data))
+
+            # The sample reaches the file before its index row, a killed run never indexes missing bytes
+            self.tar.fileobj.flush()
+            self.index_writer.writerow([key, wnid, self.tar_name, offset, size, digest])
+            self.index_f.flush()
+
+    def remove(self, digest):
+        """ Drops the samples with this sha1 from index.csv, their tar members stay but are no longer indexed """
+        index_path = os.path.join(self.shards_dir, INDEX_FILENAME)
+        with self.lock:
+            self.index_f.close()
+            with open(index_path, newline='') as index_f:
+                rows = [row for row in csv.reader(index_f) if row[-1] != digest]
+            self._write_index(index_path, rows)
+            self._open_index(index_path)
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                self.tar = None
+            self.index_f.close()
+
+
+class ShardReader():
+    """ Random access to the samples of a shard directory through index.csv and mmap """
+    def __init__(self, shards_dir):
+        self.shards_dir = shards_dir
+        self.maps = dict()
+        self.files = dict()
+
+        with open(os.path.join(shards_dir, INDEX_FILENAME), newline='') as index_f:
+            csv_reader = csv.reader(index_f)
+            next(csv_reader)
+            self.samples = [(key, wnid, shard, int(offset), int(length), sha1)
+                            for key, wnid, shard, offset, length, sha1 in csv_reader]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _map(self, shard):
+        if shard not in self.maps:
+            self.files[shard] = open(os.path.join(self.shards_dir, shard), 'rb')
+            self.maps[shard] = mmap.mmap(self.files[shard].fileno(), 0, access=mmap.ACCESS_READ)
+        return self.maps[shard]
+
+    def __getitem__(self, idx):
+        """ Returns (key, wnid, image bytes) """
+        key, wnid, shard, offset, length, _ = self.samples[idx]
+        return key, wnid, self._map(shard)[offset:offset + length]
+
+    def wnids(self):
+        return Counter(wnid for _, wnid, _, _, _, _ in self.samples)
+
+    def close(self):
+        for shard_map in self.maps.values():
+            shard_map.close()
+        for shard_f in self.files.values():
+            shard_f.close()
+        self.maps = dict()
+        self.files = dict()
+
+
+def iter_shard(shard_path):
+    """ Sequential read of one shard, yields (key, wnid, image bytes) without using the index,
+        so also samples that were removed from it as placeholders """
+    with tarfile.open(shard_path, 'r|') as tar:
+        key, data = None, None
+        for member in tar:
+            member_key, ext = os.path.splitext(member.name)
+            content = tar.extractfile(member).read()
+            if ext == '.cls':
+                if member_key == key:
+                    yield key, content.decode('utf-8'), data
+            else:
+                key, data = member_key, content
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Summary of ImageNet tar shards')
+    parser.add_argument('-shards_dir', required=True, type=str)
+    args, args_other = parser.parse_known_args()
+
+    reader = ShardReader(args.shards_dir)
+    counts = reader.wnids()
+
+    print(f'{len(reader)} images of {len(counts)} classes in {args.shards_dir}')
+    for wnid, count in counts.most_common():
+        print(f'{wnid}: {count}')
+    reader.close()
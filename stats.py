@@ -0,0 +1,223 @@
+"""
+
+    Scraping stats of a run.
+
+    Every thread that records something gets its own WorkerStats, so the hot path is a few
+    dict updates on an object no other thread writes to, without a lock. Readers aggregate
+    the workers into a snapshot, a plain dict
+
+        all / is_flickr / not_flickr   tried, success, time_spent, bytes
+        connections                    checkouts, new
+        failures                       count per failure reason
+        latency                        histogram (counts per LATENCY_BOUNDS bucket) per url class
+
+    which feeds the stdout report, stats.csv and stats.json. Snapshots of several runs can be
+    added with add_snapshots, percentiles come from the summed histograms.
+
+"""
+
+import time
+import bisect
+import threading
+
+from common import MIN_TRIES_FOR_RATE, DEFAULT_SUCCESS_RATE
+
+
+URL_CLASSES = ['is_flickr', 'not_flickr']
+
+# Upper bounds in seconds of the latency histogram buckets, 1ms to about a minute in 25% steps,
+# the last bucket catches everything slower
+LATENCY_BOUNDS = [0.001 * 1.25 ** i for i in range(50)]
+PERCENTILES = [50, 95, 99]
+
+# Readers that only need approximate numbers (the schedulers) reuse a snapshot this many seconds
+AGGREGATE_INTERVAL = 0.5
+
+
+class WorkerStats():
+    def __init__(self):
+        self.counters = dict(
+            all=dict(tried=0, success=0, time_spent=0.0, bytes=0),
+            is_flickr=dict(tried=0, success=0, time_spent=0.0, bytes=0),
+            not_flickr=dict(tried=0, success=0, time_spent=0.0, bytes=0),
+            # Connections taken from the http pools and how many of them had to be opened
+            connections=dict(checkouts=0, new=0),
+        )
+        self.failures = dict()
+        self.latency = {cls: [0] * (len(LATENCY_BOUNDS) + 1) for cls in URL_CLASSES}
+
+
+def empty_snapshot():
+    worker = WorkerStats()
+    snapshot = dict(worker.counters)
+    snapshot['failures'] = worker.failures
+    snapshot['latency'] = worker.latency
+    return snapshot
+
+
+def add_snapshots(total, snapshot):
+    """ Adds snapshot into total, counters and histograms are summed """
+    for key, values in snapshot.items():
+        total_values = total.setdefault(key, dict())
+        for name, value in values.items():
+            if isinstance(value, list):
+                total_list = total_values.setdefault(name, [0] * len(value))
+                for idx, count in enumerate(value):
+                    total_list[idx] += count
+            else:
+                total_values[name] = total_values.get(name, 0) + value
+    return total
+
+
+def latency_percentile(histogram, p):
+    """ Upper bound of the bucket holding the p-th percentile, None without samples """
+    samples = sum(histogram)
+    if samples == 0:
+        return None
+
+    rank = p / 100.0 * samples
+    seen = 0
+    for idx, count in enumerate(histogram):
+        seen += count
+        if seen >= rank and count > 0:
+            break
+    return LATENCY_BOUNDS[min(idx, len(LATENCY_BOUNDS) - 1)]
+
+
+class RunStats():
+    def __init__(self):
+        self.t_start = time.time()
+
+        self.local = threading.local()
+        self.workers_lock = threading.Lock()
+        self.workers = []
+
+        self.cached = None
+        self.cached_t = 0
+
+    def worker(self):
+        worker = getattr(self.local, 'worker', None)
+        if worker is None:
+            worker = self.local.worker = WorkerStats()
+            with self.workers_lock:
+                self.workers.append(worker)
+        return worker
+
+    def inc(self, cls, stat, val):
+        self.worker().counters[cls][stat] += val
+
+    def finish(self, cls, t_spent, status, reason=None, size=0):
+        worker = self.worker()
+        for counters in (worker.counters[cls], worker.counters['all']):
+            counters['time_spent'] += t_spent
+            counters['tried'] += 1
+            counters['bytes'] += size
+            if status == 'success':
+                counters['success'] += 1
+
+        if status != 'success':
+            reason = reason or 'unknown'
+            worker.failures[reason] = worker.failures.get(reason, 0) + 1
+
+        worker.latency[cls][bisect.bisect_left(LATENCY_BOUNDS, t_spent)] += 1
+
+    def snapshot(self):
+        """ Sum of all workers. Workers keep counting while this runs, so the numbers of one
+            snapshot can be a few updates apart from each other. """
+        with self.workers_lock:
+            workers = list(self.workers)
+
+        snapshot = empty_snapshot()
+        for worker in workers:
+            add_snapshots(snapshot, dict(worker.counters, failures=dict(worker.failures),
+                                         latency={cls: list(hist) for cls, hist in worker.latency.items()}))
+
+        self.cached = snapshot
+        self.cached_t = time.time()
+        return snapshot
+
+    def recent_snapshot(self):
+        if self.cached is None or time.time() - self.cached_t > AGGREGATE_INTERVAL:
+            return self.snapshot()
+        return self.cached
+
+    def get(self, cls, stat):
+        return self.recent_snapshot()[cls][stat]
+
+    def success_rate(self):
+        counters = self.recent_snapshot()['all']
+        if counters['tried'] < MIN_TRIES_FOR_RATE:
+            return DEFAULT_SUCCESS_RATE
+        return counters['success'] / counters['tried']
+
+    def csv_header(self):
+        header = []
+        for cls in ['all'] + URL_CLASSES:
+            header += [f'{cls}_tried', f'{cls}_success', f'{cls}_time_spent', f'{cls}_bytes']
+        header += ['connections_checkouts', 'connections_new']
+        for cls in URL_CLASSES:
+            header += [f'{cls}_latency_p{p}' for p in PERCENTILES]
+        return header
+
+    def csv_row(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        row = []
+        for cls in ['all'] + URL_CLASSES:
+            row += [snapshot[cls]['tried'], snapshot[cls]['success'], snapshot[cls]['time_spent'],
+                    snapshot[cls]['bytes']]
+        row += [snapshot['connections']['checkouts'], snapshot['connections']['new']]
+        for cls in URL_CLASSES:
+            row += [latency_percentile(snapshot['latency'][cls], p) for p in PERCENTILES]
+        return row
+
+    def print_stats(self, cls, print_func, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        counters = snapshot[cls]
+
+        actual_all_time_spent = time.time() - self.t_start
+        processes_all_time_spent = snapshot['all']['time_spent']
+
+        if processes_all_time_spent == 0:
+            actual_processes_ratio = 1.0
+        else:
+            actual_processes_ratio = actual_all_time_spent / processes_all_time_spent
+
+        print_func(f'STATS For class {cls}:')
+        print_func(f' tried {counters["tried"]} urls with'
+                   f' {counters["success"]} successes, {counters["bytes"] / 1e6:.1f} MB')
+
+        if counters['tried'] > 0:
+            print_func(f'{100.0 * counters["success"] / counters["tried"]}% success rate for {cls} urls ')
+        if counters['success'] > 0:
+            print_func(f'{counters["time_spent"] * actual_processes_ratio / counters["success"]} seconds spent per {cls} succesful image download')
+
+        if cls in snapshot['latency'] and sum(snapshot['latency'][cls]) > 0:
+            latencies = ', '.join(f'p{p} {latency_percentile(snapshot["latency"][cls], p):.3f}s' for p in PERCENTILES)
+            print_func(f' latency {latencies}')
+
+    def print_failure_stats(self, print_func, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        failures = sorted(snapshot['failures'].items(), key=lambda item: -item[1])
+
+        print_func(f'FAILURE STATS:')
+        for reason, count in failures:
+            print_func(f' {reason}: {count}')
+
+    def print_connection_stats(self, print_func, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        checkouts = snapshot['connections']['checkouts']
+        new = snapshot['connections']['new']
+
+        print_func(f'CONNECTION STATS:')
+        print_func(f' {checkouts} connections used, {new} opened, {checkouts - new} reused')
+        if checkouts > 0:
+            print_func(f'{100.0 * (checkouts - new) / checkouts}% connection reuse')
+
+    def print_report(self, print_func):
+        snapshot = self.snapshot()
+        print_func(f'\nScraping stats:')
+        self.print_stats('is_flickr', print_func, snapshot)
+        self.print_stats('not_flickr', print_func, snapshot)
+        self.print_stats('all', print_func, snapshot)
+        self.print_failure_stats(print_func, snapshot)
+        self.print_connection_stats(print_func, snapshot)
@@ -0,0 +1,203 @@
+"""
+
+    Content addressed image store.
+
+    Every accepted image is identified by the sha1 of its bytes, computed while it is streamed.
+    A hash index (SQLite, next to the images) records which classes reference which image, so
+
+      - an image that shows up again in the same class is a duplicate and does not count
+        toward the quota,
+      - an image that shows up in another class is stored once and only referenced again
+        (hardlinked into the class folder, or just recorded with the hashed layout),
+      - different urls with the same file name no longer overwrite each other,
+      - flickr "photo unavailable" placeholders are recognized by hash. Known hashes are read
+        from placeholder_hashes.txt, and any hash served for PLACEHOLDER_MIN_URLS different
+        urls is added to it and its copies are removed.
+
+    Two layouts are supported by -storage_layout:
+
+      folders   imagenet_images/<class_name>/<file name from url>   (the original layout, the folder
+                is <class_name>_<wnid> for class names that several classes share)
+      hashed    imagenet_images/objects/ab/cd/abcd....<ext>, class membership only in the index
+
+    With -output shards or both the images are (also) appended to tar shards, see shards.py.
+
+"""
+
+import os
+import csv
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+
+from shards import ShardWriter
+from journal import COMMIT_EVERY_SECONDS
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, path TEXT, size INTEGER, urls INTEGER);
+CREATE TABLE IF NOT EXISTS refs (hash TEXT, wnid TEXT, url TEXT, path TEXT, PRIMARY KEY (hash, wnid));
+CREATE INDEX IF NOT EXISTS refs_wnid ON refs (wnid);
+"""
+
+PLACEHOLDER_MIN_URLS = 20
+PLACEHOLDER_FILENAME = 'placeholder_hashes.txt'
+INDEX_FILENAME = 'content_index.sqlite'
+
+# Committed at least as often as the journal, whose success events would otherwise point at
+# images a killed run never indexed
+COMMIT_EVERY_IMAGES = 200
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ContentStore():
+    """ Images go below imagenet_images_folder, the index, placeholder list and tar shards
+        below state_folder (which differs per shard process when a run is sharded) """
+    def __init__(self, imagenet_images_folder, state_folder, layout, output='files', max_shard_bytes=0):
+        self.folder = imagenet_images_folder
+        self.layout = layout
+        self.write_files = output in ('files', 'both')
+        self.lock = threading.Lock()
+
+        self.shards = None
+        if output in ('shards', 'both'):
+            self.shards = ShardWriter(os.path.join(state_folder, 'shards'), max_shard_bytes)
+
+        self.conn = sqlite3.connect(os.path.join(state_folder, INDEX_FILENAME), check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.uncommitted = 0
+        self.last_commit = time.time()
+
+        self.placeholder_path = os.path.join(state_folder, PLACEHOLDER_FILENAME)
+        self.placeholders = set()
+        if os.path.exists(self.placeholder_path):
+            with open(self.placeholder_path) as placeholder_f:
+                self.placeholders = set(line.strip() for line in placeholder_f if line.strip())
+
+    def object_path(self, digest, img_name):
+        ext = os.path.splitext(img_name)[1].lower()
+        return os.path.join(self.folder, 'objects', digest[:2], digest[2:4], digest + ext)
+
+    def class_path(self, class_folder, img_name, digest):
+        """ The url file name, with a piece of the hash added if another image already has that name.
+            The same image under that name was stored by a run killed before the index was committed,
+            it is overwritten instead of kept twice. """
+        path = os.path.join(class_folder, img_name)
+        if os.path.exists(path) and file_sha1(path) != digest:
+            stem, ext = os.path.splitext(img_name)
+            path = os.path.join(class_folder, f'{stem}_{digest[:12]}{ext}')
+        return path
+
+    def count_images(self, wnid, class_folder):
+        """ Images of the class stored by earlier runs, they count toward the quota when resuming """
+        if self.layout == 'hashed' or not self.write_files:
+            with self.lock:
+                return self.conn.execute('SELECT COUNT(*) FROM refs WHERE wnid = ?', (wnid,)).fetchone()[0]
+        return len([name for name in os.listdir(class_folder) if not name.startswith('.')])
+
+    def save(self, wnid, img_url, img_name, class_folder, partial_path, digest, size):
+        """ Moves a completely streamed image into the store. Returns (None if it was stored, otherwise
+            why it was not ('duplicate' or 'placeholder'), [(wnid, url)] of stored images removed as placeholders). """
+        with self.lock:
+            if digest in self.placeholders:
+                os.remove(partial_path)
+                return 'placeholder', []
+
+            row = self.conn.execute('SELECT path, urls FROM images WHERE hash = ?', (digest,)).fetchone()
+            if row is not None:
+                stored_path, urls = row
+                self.conn.execute('UPDATE images SET urls = ? WHERE hash = ?', (urls + 1, digest))
+
+                if urls + 1 >= PLACEHOLDER_MIN_URLS:
+                    os.remove(partial_path)
+                    return 'placeholder', self._add_placeholder(digest)
+
+                if self.conn.execute('SELECT 1 FROM refs WHERE hash = ? AND wnid = ?', (digest, wnid)).fetchone():
+                    os.remove(partial_path)
+                    return 'duplicate', []
+
+            ext = os.path.splitext(img_name)[1].lower()
+            if self.shards is not None:
+                self.shards.add(f'{wnid}_{digest[:16]}', wnid, digest, partial_path, ext)
+
+            if not self.write_files:
+                path = None
+                os.remove(partial_path)
+            elif self.layout == 'hashed':
+                path = self.object_path(digest, img_name)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(partial_path, path)
+                else:
+                    os.remove(partial_path)
+            else:
+                path = self.class_path(class_folder, img_name, digest)
+                if row is None:
+                    os.replace(partial_path, path)
+                else:
+                    self._link_or_move(stored_path, partial_path, path)
+
+            if row is None:
+                self.conn.execute('INSERT INTO images VALUES (?, ?, ?, 1)', (digest, path, size))
+            self.conn.execute('INSERT INTO refs VALUES (?, ?, ?, ?)', (digest, wnid, img_url, path))
+
+            self.uncommitted += 1
+            if self.uncommitted >= COMMIT_EVERY_IMAGES or time.time() - self.last_commit > COMMIT_EVERY_SECONDS:
+                self.conn.commit()
+                self.uncommitted = 0
+                self.last_commit = time.time()
+
+        return None, []
+
+    def _link_or_move(self, stored_path, partial_path, path):
+        # The same image is already stored for another class, a hardlink costs no extra disk space
+        try:
+            os.link(stored_path, path)
+        except (OSError, TypeError):
+            os.replace(partial_path, path)
+        else:
+            os.remove(partial_path)
+
+    def _add_placeholder(self, digest):
+        """ Removes the stored copies of a new placeholder hash, returns [(wnid, url)] of the removed images """
+        logging.info(f'Image {digest} was served for {PLACEHOLDER_MIN_URLS} urls, treating it as a placeholder')
+        self.placeholders.add(digest)
+        with open(self.placeholder_path, 'a') as placeholder_f:
+            placeholder_f.write(digest + '\n')
+
+        refs = self.conn.execute('SELECT wnid, url, path FROM refs WHERE hash = ?', (digest,)).fetchall()
+        for path in set(path for _, _, path in refs):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        if self.shards is not None:
+            self.shards.remove(digest)
+        self.conn.execute('DELETE FROM refs WHERE hash = ?', (digest,))
+        self.conn.execute('DELETE FROM images WHERE hash = ?', (digest,))
+        return [(wnid, url) for wnid, url, _ in refs]
+
+    def export_manifest(self, manifest_path):
+        """ Writes every stored (class, image) pair as csv: wnid, url, path, sha1 """
+        with self.lock:
+            rows = self.conn.execute('SELECT wnid, url, path, hash FROM refs ORDER BY wnid').fetchall()
+
+        with open(manifest_path, 'w', newline='') as manifest_f:
+            csv_writer = csv.writer(manifest_f)
+            csv_writer.writerow(['wnid', 'url', 'path', 'sha1'])
+            csv_writer.writerows(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+            if self.shards is not None:
+                self.shards.close()
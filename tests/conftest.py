@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the downloader are top level scripts next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
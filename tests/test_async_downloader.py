@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+
+import pytest
+
+import downloader
+import mock_server
+from async_downloader import scrape_classes_async
+from journal import NoJournal
+from metrics import NoMetrics
+from planner import NoClassPlan
+from stats import RunStats
+from store import ContentStore
+from url_index import NoUrlIndex
+
+
+CLASS_INFO = {
+    'n01440764': dict(class_name='tench', img_url_count=0, flickr_img_url_count=0, shared_name=False),
+    'n01443537': dict(class_name='goldfish', img_url_count=0, flickr_img_url_count=0, shared_name=False),
+}
+
+OK_URLS_PER_CLASS = 20
+MAX_CONNECTIONS = 5
+MAX_CONNECTIONS_PER_HOST = 3
+
+
+class SlowImageHandler(mock_server.MockHandler):
+    """ Images that take a while, so fetches overlap, and a few that must be rejected """
+    def send_url_list(self, wnid):
+        port = self.server.server_address[1]
+        hosts = mock_server.HOSTS
+        urls = [f'http://{hosts[i % len(hosts)]}:{port}/flickr/{wnid}_{i}.jpg?size=large'
+                for i in range(OK_URLS_PER_CLASS)]
+        urls += [f'http://127.0.0.1:{port}/flickr/{wnid}_{name}.jpg' for name in ('small', 'exact', 'page')]
+        self.send_body(200, 'text/plain', '\n'.join(urls).encode('utf-8'))
+
+    def send_image(self, path, rng):
+        host = self.headers.get('Host')
+        with self.server.lock:
+            self.server.active[host] = self.server.active.get(host, 0) + 1
+            self.server.peak_per_host = max([self.server.peak_per_host] + list(self.server.active.values()))
+            self.server.peak = max(self.server.peak, sum(self.server.active.values()))
+        try:
+            time.sleep(0.05)
+            if path.endswith('_small.jpg'):
+                return self.send_body(200, 'image/jpeg', os.urandom(999))
+            if path.endswith('_exact.jpg'):
+                return self.send_body(200, 'image/jpeg', os.urandom(1000))
+            if path.endswith('_page.jpg'):
+                return self.send_body(200, 'text/html', b'<html>not an image</html>' * 200)
+            return super().send_image(path, rng)
+        finally:
+            with self.server.lock:
+                self.server.active[host] -= 1
+
+
+@pytest.fixture
+def server():
+    server_args = mock_server.build_parser().parse_args(['-latency_ms', '0', '-payload_kb', '2'])
+    server = mock_server.MockServer(server_args)
+    server.RequestHandlerClass = SlowImageHandler
+    server.lock = threading.Lock()
+    server.active = dict()
+    server.peak = 0
+    server.peak_per_host = 0
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def scrape(server, data_root):
+    args = downloader.build_parser().parse_args([
+        '-engine', 'asyncio',
+        '-data_root', str(data_root),
+        '-images_per_class', '1000',
+        '-api_url', f'http://127.0.0.1:{server.server_address[1]}/api?wnid={{wnid}}',
+        '-url_list_rate', '0',
+        '-async_max_connections', str(MAX_CONNECTIONS),
+        '-max_connections_per_host', str(MAX_CONNECTIONS_PER_HOST),
+    ])
+    imagenet_images_folder = os.path.join(str(data_root), 'imagenet_images')
+    os.mkdir(imagenet_images_folder)
+
+    run_stats = RunStats()
+    store = ContentStore(imagenet_images_folder, imagenet_images_folder, args.storage_layout)
+    try:
+        scrape_classes_async(args, list(CLASS_INFO), CLASS_INFO, imagenet_images_folder, run_stats, NoJournal(),
+                             store, NoMetrics(), NoUrlIndex(), NoClassPlan(args.images_per_class))
+    finally:
+        store.close()
+    return imagenet_images_folder, run_stats.snapshot()
+
+
+def test_scrape_stores_images_named_after_their_url(server, tmp_path):
+    imagenet_images_folder, snapshot = scrape(server, tmp_path)
+
+    for wnid, info in CLASS_INFO.items():
+        names = set(os.listdir(os.path.join(imagenet_images_folder, info['class_name'])))
+        # The query string is not part of the name, the 1000 byte image is just big enough
+        assert names == set(f'{wnid}_{i}.jpg' for i in range(OK_URLS_PER_CLASS)) | {f'{wnid}_exact.jpg'}
+
+    assert snapshot['all']['success'] == len(CLASS_INFO) * (OK_URLS_PER_CLASS + 1)
+
+
+def test_scrape_rejects_small_images_and_other_content_types(server, tmp_path):
+    _, snapshot = scrape(server, tmp_path)
+
+    assert snapshot['failures'] == {'too small': len(CLASS_INFO), 'not an image': len(CLASS_INFO)}
+
+
+def test_scrape_keeps_to_the_connection_limits(server, tmp_path):
+    scrape(server, tmp_path)
+
+    assert server.peak_per_host <= MAX_CONNECTIONS_PER_HOST
+    assert server.peak <= MAX_CONNECTIONS
+    # Both hosts were fetched from at once, so the global limit was the one that held
+    assert server.peak > MAX_CONNECTIONS_PER_HOST
@@ -0,0 +1,128 @@
+import os
+import sys
+import glob
+import hashlib
+import subprocess
+
+import pytest
+
+from shards import ShardWriter, ShardReader, iter_shard, INDEX_FILENAME
+
+
+WNIDS = ['n01440764', 'n01443537']
+
+
+def write_samples(shards_dir, tmp_path, count, max_shard_bytes=4096, start=0):
+    """ Appends count random samples, returns [(key, wnid, data)] in the order they were written """
+    writer = ShardWriter(str(shards_dir), max_shard_bytes)
+    samples = []
+    for i in range(start, start + count):
+        data = os.urandom(1000 + 150 * i)
+        digest = hashlib.sha1(data).hexdigest()
+        key, wnid = f'{WNIDS[i % 2]}_{digest[:16]}', WNIDS[i % 2]
+
+        img_path = tmp_path / f'{i}.jpg'
+        img_path.write_bytes(data)
+        writer.add(key, wnid, digest, str(img_path), '.jpg')
+        samples.append((key, wnid, data))
+    writer.close()
+    return samples
+
+
+def shard_paths(shards_dir):
+    return sorted(glob.glob(os.path.join(str(shards_dir), 'shard-*.tar')))
+
+
+@pytest.fixture
+def shards_dir(tmp_path):
+    return tmp_path / 'shards'
+
+
+def test_writer_rolls_over_to_new_shards(shards_dir, tmp_path):
+    write_samples(shards_dir, tmp_path, 10)
+
+    assert len(shard_paths(shards_dir)) > 1
+
+
+def test_reader_slices_match_the_samples(shards_dir, tmp_path):
+    samples = write_samples(shards_dir, tmp_path, 10)
+
+    reader = ShardReader(str(shards_dir))
+    assert len(reader) == len(samples)
+    for idx, (key, wnid, data) in enumerate(samples):
+        assert reader[idx] == (key, wnid, data)
+        assert hashlib.sha1(reader[idx][2]).hexdigest() == reader.samples[idx][5]
+    reader.close()
+
+
+def test_iter_shard_yields_every_sample_in_order(shards_dir, tmp_path):
+    samples = write_samples(shards_dir, tmp_path, 10)
+
+    read = [sample for shard_path in shard_paths(shards_dir) for sample in iter_shard(shard_path)]
+    assert read == samples
+
+
+def test_reopened_writer_appends_new_shards(shards_dir, tmp_path):
+    samples = write_samples(shards_dir, tmp_path, 6)
+    first_shards = shard_paths(shards_dir)
+    first_sizes = [os.path.getsize(path) for path in first_shards]
+
+    samples += write_samples(shards_dir, tmp_path, 6, start=6)
+
+    # Shards of the first run are left as they were, the second run starts its own
+    assert shard_paths(shards_dir)[:len(first_shards)] == first_shards
+    assert [os.path.getsize(path) for path in first_shards] == first_sizes
+    assert len(shard_paths(shards_dir)) > len(first_shards)
+
+    # One header, every sample of both runs
+    with open(os.path.join(str(shards_dir), INDEX_FILENAME)) as index_f:
+        assert sum(1 for line in index_f if line.startswith('key,')) == 1
+
+    reader = ShardReader(str(shards_dir))
+    assert [reader[idx] for idx in range(len(reader))] == samples
+    reader.close()
+
+
+def test_removed_samples_leave_the_index(shards_dir, tmp_path):
+    samples = write_samples(shards_dir, tmp_path, 6)
+    removed_digest = hashlib.sha1(samples[2][2]).hexdigest()
+
+    writer = ShardWriter(str(shards_dir), 4096)
+    writer.remove(removed_digest)
+    writer.close()
+
+    reader = ShardReader(str(shards_dir))
+    assert [reader[idx] for idx in range(len(reader))] == samples[:2] + samples[3:]
+    reader.close()
+
+
+def test_killed_writer_leaves_readable_samples(shards_dir, tmp_path):
+    # Three samples, then the process dies without closing the writer
+    tests_folder = os.path.dirname(os.path.realpath(__file__))
+    script = (f'import os, sys; sys.path[:0] = [{os.path.dirname(tests_folder)!r}, {tests_folder!r}]\n'
+              f'import pathlib, test_shards\n'
+              f'test_shards.ShardWriter.close = lambda self: os._exit(0)\n'
+              f'test_shards.write_samples(pathlib.Path({str(shards_dir)!r}), pathlib.Path({str(tmp_path)!r}), 3, 1 << 20)\n')
+    subprocess.run([sys.executable, '-c', script], check=True)
+
+    samples = write_samples(shards_dir, tmp_path, 3, start=3)
+    reader = ShardReader(str(shards_dir))
+    assert len(reader) == 6
+    assert [reader[idx] for idx in range(3, 6)] == samples
+    for idx in range(len(reader)):
+        assert hashlib.sha1(reader[idx][2]).hexdigest() == reader.samples[idx][5]
+    reader.close()
+
+
+def test_reopened_writer_drops_samples_of_truncated_shards(shards_dir, tmp_path):
+    samples = write_samples(shards_dir, tmp_path, 3, max_shard_bytes=1 << 20)
+    shard_path = shard_paths(shards_dir)[0]
+    last_offset = ShardReader(str(shards_dir)).samples[-1][3]
+    with open(shard_path, 'r+b') as shard_f:
+        shard_f.truncate(last_offset + 10)
+
+    samples = samples[:2] + write_samples(shards_dir, tmp_path, 2, start=3)
+
+    reader = ShardReader(str(shards_dir))
+    assert [reader[idx] for idx in range(len(reader))] == samples
+    reader.close()
@@ -0,0 +1,140 @@
+"""
+
+    Local index of the ImageNet url lists, so a run does not have to ask the synset API for
+    every class.
+
+    It is built once from the fall11 url dump
+    (http://image-net.org/imagenet_data/urls/imagenet_fall11_urls.tgz), whose lines are
+
+        n00004475_6590<TAB>http://farm4.static.flickr.com/3175/2737866473_7958dc8760.jpg
+
+    into a SQLite file with one row per wnid holding its zlib compressed url list, in the
+    order of the dump. Looking up a class is a single primary key read.
+
+        python url_index.py -url_list /datasets/imagenet/fall11_urls.txt -index url_index.sqlite
+
+    The downloader uses it with -url_index url_index.sqlite and only falls back to the API for
+    classes that are not in the index (or skips them with -offline True).
+
+"""
+
+import os
+import zlib
+import codecs
+import sqlite3
+import argparse
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_lists (wnid TEXT PRIMARY KEY, urls INTEGER, data BLOB);
+"""
+
+COMMIT_EVERY_CLASSES = 500
+
+
+def encode_urls(urls):
+    return zlib.compress('\n'.join(urls).encode('utf-8'))
+
+
+def decode_urls(data):
+    return zlib.decompress(data).decode('utf-8').split('\n')
+
+
+def iter_url_dump(url_list_path):
+    """ Yields (wnid, url) for every well formed line of the dump """
+    with codecs.open(url_list_path, 'r', encoding='utf-8', errors='ignore') as url_list_f:
+        for line in url_list_f:
+            row = line.rstrip('\r\n').split('\t')
+            if len(row) != 2:
+                continue
+            yield row[0].split('_')[0], row[1]
+
+
+def build_url_index(url_list_path, index_path, print_every=1000000):
+    """ The dump is grouped by wnid, a class that shows up again later is appended to """
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    conn = sqlite3.connect(index_path)
+    conn.executescript(SCHEMA)
+
+    def store(wnid, urls):
+        row = conn.execute('SELECT data FROM url_lists WHERE wnid = ?', (wnid,)).fetchone()
+        if row is not None:
+            urls = decode_urls(row[0]) + urls
+        conn.execute('INSERT OR REPLACE INTO url_lists VALUES (?, ?, ?)', (wnid, len(urls), encode_urls(urls)))
+
+    current_wnid = None
+    current_urls = []
+    classes = 0
+    lines = 0
+
+    for wnid, url in iter_url_dump(url_list_path):
+        lines += 1
+        if lines % print_every == 0:
+            print(f'{lines} urls, {classes} classes')
+
+        if wnid != current_wnid:
+            if current_wnid is not None:
+                store(current_wnid, current_urls)
+                classes += 1
+                if classes % COMMIT_EVERY_CLASSES == 0:
+                    conn.commit()
+            current_wnid = wnid
+            current_urls = []
+        current_urls.append(url)
+
+    if current_wnid is not None:
+        store(current_wnid, current_urls)
+
+    conn.commit()
+    classes = conn.execute('SELECT COUNT(*) FROM url_lists').fetchone()[0]
+    conn.close()
+    return lines, classes
+
+
+class UrlIndex():
+    def __init__(self, index_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(f'file:{index_path}?mode=ro', uri=True, check_same_thread=False)
+
+    def url_list(self, wnid):
+        """ The url list of the class, None if the class is not in the index """
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM url_lists WHERE wnid = ?', (wnid,)).fetchone()
+        if row is None:
+            return None
+        return decode_urls(row[0])
+
+    def url_count(self, wnid):
+        with self.lock:
+            row = self.conn.execute('SELECT urls FROM url_lists WHERE wnid = ?', (wnid,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class NoUrlIndex():
+    """ Used without -url_index, every url list comes from the API """
+    def url_list(self, wnid):
+        return None
+
+    def url_count(self, wnid):
+        return 0
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the local ImageNet url index from the fall11 url dump')
+    parser.add_argument('-url_list', required=True, type=str)
+    parser.add_argument('-index', default='url_index.sqlite', type=str)
+    args, args_other = parser.parse_known_args()
+
+    lines, classes = build_url_index(args.url_list, args.index)
+    print(f'Indexed {lines} urls of {classes} classes into {args.index}')
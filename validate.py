@@ -0,0 +1,140 @@
+"""
+
+    Image validation stage, run on every completely streamed image before it is stored.
+
+    Decoding is CPU bound, so it runs in a pool of -validate_processes worker processes
+    instead of the fetcher threads. A worker fully decodes the image and rejects it as
+
+        corrupt image   not an image Pillow can open, or truncated / broken while decoding
+        too large       more pixels than Pillow's decompression bomb limit
+        too small       a side shorter than MIN_SIDE pixels (tracking pixels, icons)
+        placeholder     (nearly) a single flat color, like blank "photo unavailable" images
+
+    Rejected files are removed, so only images that pass count toward -images_per_class.
+    With -resize_short_side the image is scaled down to that short side and re-encoded as
+    JPEG at -jpeg_quality, with -jpeg_quality alone it is only re-encoded. The hash of the
+    file that is finally written is returned, so duplicates and placeholders are detected
+    on what ends up on disk.
+
+    Needs Pillow, which is only imported once -validate_images True is used.
+
+"""
+
+import os
+import io
+import hashlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+
+MIN_SIDE = 32
+
+# Images whose grayscale standard deviation over a PLACEHOLDER_THUMBNAIL thumbnail is below this are flat
+PLACEHOLDER_THUMBNAIL = (64, 64)
+PLACEHOLDER_MAX_STDDEV = 2.0
+
+DEFAULT_JPEG_QUALITY = 90
+
+
+def check_decoded(img):
+    """ Returns None for a usable decoded image, otherwise the failure reason """
+    from PIL import ImageStat
+
+    if min(img.size) < MIN_SIDE:
+        return 'too small'
+
+    thumbnail = img.convert('L')
+    thumbnail.thumbnail(PLACEHOLDER_THUMBNAIL)
+    if ImageStat.Stat(thumbnail).stddev[0] < PLACEHOLDER_MAX_STDDEV:
+        return 'placeholder'
+
+    return None
+
+
+def reencode(img, short_side, quality):
+    """ JPEG bytes of img, scaled down to short_side first if it is bigger """
+    from PIL import Image
+
+    if short_side > 0 and min(img.size) > short_side:
+        scale = short_side / min(img.size)
+        size = (max(1, round(img.size[0] * scale)), max(1, round(img.size[1] * scale)))
+        img = img.resize(size, Image.LANCZOS)
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality or DEFAULT_JPEG_QUALITY)
+    return buf.getvalue()
+
+
+def validate_image(task):
+    """ Runs in a worker process. Returns (failure reason or None, img_name, size, sha1 hex digest),
+        the file is removed if it is rejected and rewritten if it is re-encoded. """
+    path, img_name, size, digest, short_side, quality = task
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            # draft() can already scale the image down to short_side, so the size in the file decides on re-encoding
+            original_size = img.size
+            if short_side > 0 and img.format == 'JPEG':
+                # Lets libjpeg decode at the smallest 1/2, 1/4 or 1/8 scale that still covers short_side
+                img.draft('RGB', (short_side, short_side))
+            img.load()
+            reason = check_decoded(img)
+
+            data = None
+            if reason is None and (quality > 0 or (short_side > 0 and min(original_size) > short_side)):
+                data = reencode(img, short_side, quality)
+    except Image.DecompressionBombError:
+        reason = 'too large'
+    except (OSError, SyntaxError, ValueError, EOFError):
+        reason = 'corrupt image'
+
+    if reason is not None:
+        os.remove(path)
+        return reason, img_name, size, digest
+
+    if data is not None:
+        with open(path, 'wb') as img_f:
+            img_f.write(data)
+        img_name = os.path.splitext(img_name)[0] + '.jpg'
+        size = len(data)
+        digest = hashlib.sha1(data).hexdigest()
+
+    return None, img_name, size, digest
+
+
+class ImageValidator():
+    def __init__(self, processes, short_side=0, quality=0):
+        from PIL import Image  # noqa: F401, fails here instead of in every worker without Pillow
+
+        self.short_side = short_side
+        self.quality = quality
+        # Workers are spawned, forking a process that already runs threads is not safe
+        self.pool = ProcessPoolExecutor(max(1, processes), mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, path, img_name, size, digest):
+        """ A concurrent.futures.Future of validate_image """
+        return self.pool.submit(validate_image, (path, img_name, size, digest, self.short_side, self.quality))
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+class NoValidator():
+    """ Used without -validate_images, every streamed image is passed on as it is """
+    def submit(self, path, img_name, size, digest):
+        future = Future()
+        future.set_result((None, img_name, size, digest))
+        return future
+
+    def close(self):
+        pass
+
+
+def make_validator(args):
+    if not args.validate_images:
+        return NoValidator()
+    return ImageValidator(args.validate_processes, args.resize_short_side, args.jpeg_quality)